@@ -0,0 +1,302 @@
+import numpy as np
+import pandas as pd
+
+# numba is optional, without it the kernels run as plain Python loops over the arrays
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# Bars dropped from the start of the history before simulating, as generate_MAt_signals does
+WARMUP_BARS = 9
+
+
+# Function to calculate the MA, true range and ATR arrays from price arrays
+def calculate_indicator_arrays(high, low, close, short_window=10, atr_period=14):
+    close_series = pd.Series(close, copy=False)
+    ma = close_series.rolling(window=short_window, min_periods=1).mean().to_numpy()
+
+    previous_close = close_series.shift(1).to_numpy()
+    tr = np.maximum(high - low, np.maximum(abs(high - previous_close), abs(low - previous_close)))
+    atr = pd.Series(tr, copy=False).rolling(window=atr_period).mean().to_numpy()
+
+    return ma, tr, atr
+
+
+# Function to calculate indicators
+def calculate_indicators(data, short_window=10, atr_period=14):
+    data['MA_S'], data['TR'], data['ATR'] = calculate_indicator_arrays(data['high'].to_numpy(dtype=np.float64),
+                                                                       data['low'].to_numpy(dtype=np.float64),
+                                                                       data['close'].to_numpy(dtype=np.float64),
+                                                                       short_window, atr_period)
+
+    return data
+
+
+# Function to find the strict local minima and maxima of the moving average (same as argrelextrema, order=1)
+def find_extrema(ma):
+    minima = np.zeros(len(ma), dtype=bool)
+    maxima = np.zeros(len(ma), dtype=bool)
+    if len(ma) > 2:
+        minima[1:-1] = (ma[1:-1] < ma[:-2]) & (ma[1:-1] < ma[2:])
+        maxima[1:-1] = (ma[1:-1] > ma[:-2]) & (ma[1:-1] > ma[2:])
+    return minima, maxima
+
+
+# Function to generate the MA extrema signals as an array, shifted to the second bar after the extrema
+def generate_signal_array(ma, close, atr, volatility_threshold=0.001):
+    n = len(ma)
+    minima, maxima = find_extrema(ma)
+    low_volatility = atr < volatility_threshold * close
+
+    raw_signal = np.zeros(n)
+    raw_signal[minima & low_volatility] = 1
+    raw_signal[maxima & low_volatility] = -1
+
+    signal = np.full(n, np.nan)
+    signal[2:] = raw_signal[:n - 2]
+
+    # Index of the extrema before each bar (-1 if there is none yet)
+    extrema = minima | maxima
+    extrema_index = np.where(extrema, np.arange(n), -1)
+    previous_extrema = np.full(n, -1)
+    previous_extrema[1:] = np.maximum.accumulate(extrema_index)[:-1]
+
+    # A signal at bar i always comes from the extrema at i - 2, so the second last extrema is the one before it
+    signal_bars = np.flatnonzero(signal[2:] != 0) + 2
+    last_index = signal_bars - 2
+    second_last_index = previous_extrema[last_index]
+    has_second = second_last_index >= 0
+    signal_bars = signal_bars[has_second]
+    last_index = last_index[has_second]
+    second_last_index = second_last_index[has_second]
+
+    distance_open_ma = np.abs(close[signal_bars - 1] - ma[signal_bars - 1])
+    distance_extrema = np.abs(ma[last_index] - ma[second_last_index])
+    signal[signal_bars[distance_open_ma >= distance_extrema]] = 0
+
+    return signal
+
+
+# Function to run the trading simulation over raw price arrays
+@njit(cache=True)
+def simulate_trading_kernel(open_prices, spread, signal, ma, low, high, initial_capital, leverage, risk):
+    n = len(open_prices)
+    capital = initial_capital
+    position = 0.0  # Positive for long, negative for short
+    balance = np.empty(n)
+    profitable = np.full(n, np.nan)  # 1 or 0 at the bar each position was opened
+    stop_loss_hit = np.full(n, np.nan)  # Stop loss price at the bar it was hit
+    profitable_signals = 0
+    total_signals = 0
+    has_stop = False
+    stop_loss = 0.0
+    open_price = 0.0
+    open_index = -1
+
+    for i in range(n):
+        buy_price = open_prices[i] + spread[i] / (2 * 100)
+        sell_price = open_prices[i] - spread[i] / (2 * 100)
+
+        if position > 0:
+            profit_loss = position * (sell_price - open_price)
+        elif position < 0:
+            profit_loss = position * (buy_price - open_price)
+        else:
+            profit_loss = 0.0
+
+        balance[i] = capital + profit_loss
+
+        if signal[i] == 1:
+            if position < 0:
+                capital += profit_loss
+                position = 0.0
+                if profit_loss > 0:
+                    profitable_signals += 1
+                    profitable[open_index] = 1
+                else:
+                    profitable[open_index] = 0
+            if position == 0:
+                # Open new long position
+                open_price = buy_price
+                position = (risk * capital * leverage) / open_price
+                open_index = i
+            total_signals += 1
+
+        elif signal[i] == -1:
+            if position > 0:
+                capital += profit_loss
+                position = 0.0
+                if profit_loss > 0:
+                    profitable_signals += 1
+                    profitable[open_index] = 1
+                else:
+                    profitable[open_index] = 0
+            if position == 0:
+                # Open new short position
+                open_price = sell_price
+                position = -(risk * capital * leverage) / open_price
+                open_index = i
+            total_signals += 1
+
+        # Update stop loss only if in a profitable position (the stop is not reset on a signal reversal)
+        if profit_loss > 0 and i > 1:
+            new_stop_loss = ma[i - 2]
+            if position > 0:
+                if not has_stop or new_stop_loss > stop_loss:
+                    stop_loss = new_stop_loss
+                    has_stop = True
+            elif position < 0:
+                if not has_stop or new_stop_loss < stop_loss:
+                    stop_loss = new_stop_loss
+                    has_stop = True
+
+        # Check stop loss
+        if has_stop:
+            if (position > 0 and low[i] < stop_loss) or (position < 0 and high[i] > stop_loss):
+                profit_loss = position * (stop_loss - open_price)
+                capital += profit_loss
+                stop_loss_hit[i] = stop_loss
+                position = 0.0
+                has_stop = False
+                if profit_loss > 0:
+                    profitable_signals += 1
+                    profitable[open_index] = 1
+                else:
+                    profitable[open_index] = 0
+
+    return balance, profitable, stop_loss_hit, capital, profitable_signals, total_signals
+
+
+# Function to rebuild the trades of a simulation from its signal, stop loss and balance arrays. Each opened
+# position gets a sequential id from 1, so its trade can be matched to the live ledger
+@njit(cache=True)
+def extract_trades(open_prices, spread, signal, stop_loss_hit, balance, leverage, risk):
+    n = len(open_prices)
+    position_id = np.empty(n, np.int64)
+    entry_index = np.empty(n, np.int64)
+    exit_index = np.empty(n, np.int64)
+    direction = np.empty(n, np.int8)
+    entry_price = np.empty(n)
+    exit_price = np.empty(n)
+    size = np.empty(n)
+    pnl = np.empty(n)
+    exit_reason = np.empty(n, np.int8)
+    count = 0
+    bars_in_market = 0
+    position = 0.0
+    open_price = 0.0
+    open_index = -1
+    opened = 0
+
+    for i in range(n):
+        buy_price = open_prices[i] + spread[i] / (2 * 100)
+        sell_price = open_prices[i] - spread[i] / (2 * 100)
+
+        # Same order of operations as simulate_trading_kernel: close on a reversal, then open from flat
+        if (signal[i] == 1 and position < 0) or (signal[i] == -1 and position > 0):
+            close_price = buy_price if position < 0 else sell_price
+            position_id[count] = opened
+            entry_index[count] = open_index
+            exit_index[count] = i
+            direction[count] = 1 if position > 0 else -1
+            entry_price[count] = open_price
+            exit_price[count] = close_price
+            size[count] = abs(position)
+            pnl[count] = position * (close_price - open_price)
+            exit_reason[count] = 0
+            count += 1
+            position = 0.0
+        if (signal[i] == 1 or signal[i] == -1) and position == 0:
+            # The capital at the open equals the balance marked at that bar once any reversal has closed
+            open_price = buy_price if signal[i] == 1 else sell_price
+            position = (risk * balance[i] * leverage) / open_price
+            if signal[i] == -1:
+                position = -position
+            open_index = i
+            opened += 1
+
+        if not np.isnan(stop_loss_hit[i]) and position != 0:
+            position_id[count] = opened
+            entry_index[count] = open_index
+            exit_index[count] = i
+            direction[count] = 1 if position > 0 else -1
+            entry_price[count] = open_price
+            exit_price[count] = stop_loss_hit[i]
+            size[count] = abs(position)
+            pnl[count] = position * (stop_loss_hit[i] - open_price)
+            exit_reason[count] = 1
+            count += 1
+            position = 0.0
+
+        if position != 0:
+            bars_in_market += 1
+
+    # A position still open at the end is marked to the last bar
+    if position != 0:
+        close_price = open_prices[n - 1] - spread[n - 1] / (2 * 100) if position > 0 \
+            else open_prices[n - 1] + spread[n - 1] / (2 * 100)
+        position_id[count] = opened
+        entry_index[count] = open_index
+        exit_index[count] = n - 1
+        direction[count] = 1 if position > 0 else -1
+        entry_price[count] = open_price
+        exit_price[count] = close_price
+        size[count] = abs(position)
+        pnl[count] = position * (close_price - open_price)
+        exit_reason[count] = 2
+        count += 1
+
+    return (position_id[:count], entry_index[:count], exit_index[:count], direction[:count], entry_price[:count],
+            exit_price[:count], size[:count], pnl[:count], exit_reason[:count], bars_in_market)
+
+
+# Function to pull the simulation columns out of a DataFrame as contiguous float64 arrays
+def simulation_arrays(data):
+    return tuple(np.ascontiguousarray(data[column].to_numpy(dtype=np.float64))
+                 for column in ('open', 'spread', 'Signal', 'MA_S', 'low', 'high'))
+
+
+# Function to run the simulation on a DataFrame and return the raw results
+def run_simulation(data, initial_capital=10000, leverage=100, risk=0.01):
+    open_prices, spread, signal, ma, low, high = simulation_arrays(data)
+    return simulate_trading_kernel(open_prices, spread, signal, ma, low, high,
+                                   float(initial_capital), float(leverage), float(risk))
+
+
+# Function to run indicators, signals and the simulation straight from price arrays
+def backtest_arrays(open_prices, high, low, close, spread, short_window=10, atr_period=14,
+                    volatility_threshold=0.001, initial_capital=10000, leverage=100, risk=0.01):
+    ma, tr, atr = calculate_indicator_arrays(high, low, close, short_window, atr_period)
+    signal = generate_signal_array(ma, close, atr, volatility_threshold)
+    start = WARMUP_BARS
+    return simulate_trading_kernel(open_prices[start:], spread[start:], signal[start:], ma[start:], low[start:],
+                                   high[start:], float(initial_capital), float(leverage), float(risk))
+
+
+# Function to run indicators, signals and the simulation on a DataFrame and return it with the result columns
+def backtest_frame(data, short_window=10, atr_period=14, volatility_threshold=0.001, initial_capital=10000,
+                   leverage=100, risk=0.01):
+    data = calculate_indicators(data, short_window, atr_period)
+    data['Signal'] = generate_signal_array(data['MA_S'].to_numpy(dtype=np.float64),
+                                           data['close'].to_numpy(dtype=np.float64),
+                                           data['ATR'].to_numpy(dtype=np.float64), volatility_threshold)
+    data = data.iloc[WARMUP_BARS:].copy()
+    balance, profitable, stop_loss_hit, capital, profitable_signals, total_signals = \
+        run_simulation(data, initial_capital, leverage, risk)
+    data['Profitable'] = profitable
+    data['StopLoss'] = stop_loss_hit
+    data['Balance'] = balance
+    return data
+
+
+# Function to calculate the largest peak to trough fall of a balance curve, as a fraction of the peak
+def max_drawdown(balance):
+    if len(balance) == 0:
+        return 0.0
+    peak = np.maximum.accumulate(balance)
+    return float(np.max((peak - balance) / peak))
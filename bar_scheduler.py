@@ -0,0 +1,104 @@
+import time
+
+
+# Function to convert an MT5 timeframe constant to seconds
+def timeframe_seconds(timeframe):
+    if timeframe < 16384:
+        return timeframe * 60
+    return (timeframe - 16384) * 3600
+
+
+# Fires on the first tick of each new bar, tracking whether the market is open from the tick stream
+class BarCloseScheduler:
+    def __init__(self, terminal, symbol, timeframe, clock, poll_interval=0.01, closed_poll_interval=1.0,
+                 closed_after=None, wake_early=0.5):
+        self.terminal = terminal
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.clock = clock
+        self.period = timeframe_seconds(timeframe)
+        self.poll_interval = poll_interval
+        self.closed_poll_interval = closed_poll_interval
+        self.closed_after = self.period if closed_after is None else closed_after  # Seconds without ticks
+        self.wake_early = wake_early
+        self.market_open = True
+        self.on_market_closed = None
+        self.on_market_reopened = None
+        self.current_bar = None  # Server start time of the bar the last tick fell in
+        self.closed_bar = None  # Server start time of the bar that closed most recently
+        self.last_tick_msc = None
+        self.last_tick_time = None
+        self.last_tick_seen = None  # Local clock time the last new tick was seen
+        self.closed_tick_msc = None  # Server time of the tick that closed the last bar
+        self.closed_seen_at = None  # perf_counter time that tick was seen, for tick-to-order latency
+
+    def _bar_start(self, server_time):
+        return server_time - server_time % self.period
+
+    def _seconds_since_last_tick(self, now):
+        return (now - self.last_tick_seen).total_seconds()
+
+    # Check the latest tick once, returning the start time of the bar that just closed or None
+    def poll(self, now):
+        tick = self.terminal.symbol_info_tick(self.symbol)
+
+        if tick is not None and tick.time_msc != self.last_tick_msc:
+            self.last_tick_msc = tick.time_msc
+            self.last_tick_time = tick.time
+            self.last_tick_seen = now
+            if not self.market_open:
+                self.market_open = True
+                if self.on_market_reopened is not None:
+                    self.on_market_reopened()
+
+            bar = self._bar_start(tick.time)
+            if self.current_bar is None:
+                self.current_bar = bar
+            elif bar > self.current_bar:
+                self.closed_bar = self.current_bar
+                self.current_bar = bar
+                self.closed_tick_msc = tick.time_msc
+                self.closed_seen_at = time.perf_counter()
+                return self.closed_bar
+
+        elif self.market_open and self.last_tick_seen is not None and \
+                self._seconds_since_last_tick(now) >= self.closed_after:
+            self.market_open = False
+            if self.on_market_closed is not None:
+                self.on_market_closed()
+
+        return None
+
+    # Block until the first tick of a new bar and return the start time of the bar that just closed
+    def wait_for_bar_close(self):
+        while True:
+            now = self.clock.now()
+            closed_bar = self.poll(now)
+            if closed_bar is not None:
+                return closed_bar
+            self.clock.sleep(self.sleep_time(now))
+
+    # Seconds to wait before the next poll
+    def sleep_time(self, now):
+        if not self.market_open:
+            return self.closed_poll_interval
+        if self.current_bar is None:
+            return self.poll_interval
+
+        # Sleep until just before the expected bar boundary, then poll ticks closely
+        server_now = self.last_tick_time + self._seconds_since_last_tick(now)
+        remaining = self.current_bar + self.period - server_now
+        if remaining > self.wake_early + self.poll_interval:
+            return remaining - self.wake_early
+        return self.poll_interval
+
+    # Fetch the last completed bars, waiting briefly if the terminal has not built the closed bar yet
+    def copy_closed_rates(self, count, timeout=1.0):
+        waited = 0.0
+        while True:
+            rates = self.terminal.copy_rates_from_pos(self.symbol, self.timeframe, 1, count)
+            if self.closed_bar is None or waited >= timeout or \
+                    (rates is not None and len(rates) > 0 and rates['time'][-1] >= self.closed_bar):
+                return rates
+            self.clock.sleep(self.poll_interval)
+            waited += self.poll_interval
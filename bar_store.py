@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+
+# Record layout returned by copy_rates_from_pos, stored as-is so reads can be memory-mapped
+BAR_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('tick_volume', '<u8'),
+    ('spread', '<i4'),
+    ('real_volume', '<u8'),
+])
+
+
+# Function to convert rates from the terminal (or any structured array with the same fields) to the stored layout
+def to_bar_records(rates):
+    records = np.empty(len(rates), dtype=BAR_DTYPE)
+    for name in BAR_DTYPE.names:
+        records[name] = rates[name]
+    return records
+
+
+# Local store of completed bars, one append-only file per symbol and timeframe. The files hold the raw records
+# rather than Parquet so reads can be memory-mapped without a copy
+class BarStore:
+    def __init__(self, root='bar_data'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, symbol, timeframe):
+        return os.path.join(self.root, f"{symbol}_{timeframe}.bars")
+
+    # Memory-mapped view of every stored bar (read only, no copy)
+    def bars(self, symbol, timeframe):
+        path = self.path(symbol, timeframe)
+        count = os.path.getsize(path) // BAR_DTYPE.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.empty(0, dtype=BAR_DTYPE)
+        return np.memmap(path, dtype=BAR_DTYPE, mode='r', shape=(count,))
+
+    def last_time(self, symbol, timeframe):
+        bars = self.bars(symbol, timeframe)
+        return int(bars['time'][-1]) if len(bars) else None
+
+    def append(self, symbol, timeframe, rates):
+        records = to_bar_records(rates)
+        last_time = self.last_time(symbol, timeframe)
+        if last_time is not None:
+            records = records[records['time'] > last_time]
+        if len(records) == 0:
+            return 0
+
+        path = self.path(symbol, timeframe)
+        with open(path, 'ab') as file:
+            # Drop a partial record left by an interrupted write before appending
+            file.truncate(os.path.getsize(path) // BAR_DTYPE.itemsize * BAR_DTYPE.itemsize)
+            file.write(records.tobytes())
+        return len(records)
+
+    # Fetch only the completed bars newer than the last stored one and append them
+    def update(self, source, symbol, timeframe, history_bars=10000, batch=500):
+        last_time = self.last_time(symbol, timeframe)
+        if last_time is None:
+            rates = source.copy_rates_from_pos(symbol, timeframe, 1, history_bars)
+        else:
+            # Grow the request until it reaches back to the stored tail
+            count = batch
+            while True:
+                rates = source.copy_rates_from_pos(symbol, timeframe, 1, count)
+                if rates is None or len(rates) < count or rates['time'][0] <= last_time or count >= history_bars:
+                    break
+                count = min(count * 2, history_bars)
+
+        if rates is None or len(rates) == 0:
+            return 0
+
+        added = 0
+        if last_time is not None and rates['time'][0] > last_time:
+            # More bars were missed than the request reaches back, so fill the gap up to the stored tail
+            gap = source.copy_rates_range(symbol, timeframe, last_time + 1, int(rates['time'][0]) - 1)
+            if gap is None:
+                print(f"Could not fetch the {symbol} bars between {last_time} and {rates['time'][0]}, "
+                      f"the stored bars have a gap")
+            elif len(gap):
+                added = self.append(symbol, timeframe, gap)
+        return added + self.append(symbol, timeframe, rates)
+
+    # Zero-copy slice of stored bars by time (seconds or datetime) and/or the last N bars
+    def slice(self, symbol, timeframe, start=None, end=None, last=None):
+        bars = self.bars(symbol, timeframe)
+        times = bars['time']
+        lo = 0 if start is None else int(np.searchsorted(times, to_seconds(start), side='left'))
+        hi = len(bars) if end is None else int(np.searchsorted(times, to_seconds(end), side='right'))
+        if last is not None:
+            lo = max(lo, hi - last)
+        return bars[lo:hi]
+
+    # DataFrame in the same shape as pd.DataFrame(mt5.copy_rates_from_pos(...)) with parsed times
+    def frame(self, symbol, timeframe, start=None, end=None, last=None):
+        # Imported here so the live bot starts without pandas
+        import pandas as pd
+
+        data = pd.DataFrame(self.slice(symbol, timeframe, start, end, last))
+        data['time'] = pd.to_datetime(data['time'], unit='s')
+        return data
+
+
+# Function to convert a time (epoch seconds, a digit string, a datetime or a date string) to epoch seconds,
+# reading times without a timezone as UTC like the terminal's bar times
+def to_seconds(value):
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    import pandas as pd
+
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return int(timestamp.timestamp())
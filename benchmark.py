@@ -0,0 +1,251 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import WARMUP_BARS, calculate_indicators, generate_signal_array, run_simulation
+from bar_store import BAR_DTYPE
+from lean_backtest import backtest_lean
+from live_engine import Instrument
+from streaming_indicators import stream_signals
+
+SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+STREAM_MAX_BARS = 1_000_000  # The bar-by-bar stages are pure Python, larger sizes take minutes
+REFERENCE_PATH = os.path.join('benchmarks', 'reference.json')
+TOLERANCE = 1e-9
+
+
+# Function to generate XAUUSD-like M5 bars: a random walk around 2000 with gold's volatility, weekend gaps and
+# a spread in points
+def synthetic_bars(n, seed=0, price=2000.0, volatility=0.0007, start='2020-01-06'):
+    rng = np.random.default_rng(seed)
+    bars_per_week = 5 * 288
+    index = np.arange(n, dtype=np.int64)
+    start_seconds = int(pd.Timestamp(start).timestamp())  # A Monday
+    times = start_seconds + index // bars_per_week * 7 * 86400 + index % bars_per_week * 300
+
+    close = price * np.exp(np.cumsum(rng.normal(0.0, volatility, n)))
+    open_prices = np.empty(n)
+    open_prices[0] = price
+    open_prices[1:] = close[:-1] + rng.normal(0.0, 0.02, n - 1)
+    body_high = np.maximum(open_prices, close)
+    body_low = np.minimum(open_prices, close)
+    high = body_high + np.abs(rng.normal(0.0, volatility * price * 0.5, n))
+    low = body_low - np.abs(rng.normal(0.0, volatility * price * 0.5, n))
+
+    bars = np.zeros(n, dtype=BAR_DTYPE)
+    bars['time'] = times
+    bars['open'] = np.round(open_prices, 2)
+    bars['high'] = np.round(high, 2)
+    bars['low'] = np.round(low, 2)
+    bars['close'] = np.round(close, 2)
+    bars['tick_volume'] = rng.integers(50, 500, n)
+    bars['spread'] = rng.integers(10, 40, n)
+    return bars
+
+
+def _frame(bars):
+    data = pd.DataFrame(bars)
+    data['time'] = pd.to_datetime(data['time'], unit='s')
+    return data.set_index('time')
+
+
+# Function to summarise an output array so runs can be compared: a hash when the values are whole numbers
+# (signals), otherwise the sum and last value, compared within a tolerance
+def _digest(values):
+    values = np.ascontiguousarray(values)
+    finite = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+    digest = {'count': int(len(finite)), 'sum': float(np.sum(finite))}
+    if np.array_equal(finite, np.round(finite)):
+        digest['sha1'] = hashlib.sha1(values.tobytes()).hexdigest()
+    elif len(finite):
+        digest['last'] = float(finite[-1])
+    return digest
+
+
+def stage_indicators(state):
+    state['data'] = calculate_indicators(state['data'])
+    return {'MA_S': _digest(state['data']['MA_S'].to_numpy()), 'ATR': _digest(state['data']['ATR'].to_numpy())}
+
+
+def stage_signals(state):
+    data = state['data']
+    state['signal'] = generate_signal_array(data['MA_S'].to_numpy(dtype=np.float64),
+                                            data['close'].to_numpy(dtype=np.float64),
+                                            data['ATR'].to_numpy(dtype=np.float64))
+    data['Signal'] = state['signal']
+    state['data'] = data.iloc[WARMUP_BARS:].copy()
+    return {'Signal': _digest(data['Signal'].to_numpy())}
+
+
+def stage_simulation(state):
+    balance, profitable, stop_loss_hit, capital, profitable_signals, total_signals = run_simulation(state['data'])
+    return {'balance': _digest(balance), 'final_capital': float(capital), 'total_signals': int(total_signals),
+            'profitable_signals': int(profitable_signals)}
+
+
+def stage_lean(state):
+    result = backtest_lean(state['bars'])
+    return {'balance': _digest(result.balance), 'final_capital': float(result.capital),
+            'total_signals': result.total_signals, 'profitable_signals': result.profitable_signals}
+
+
+def stage_stream(state):
+    bars = state['bars']
+    signal = stream_signals(bars['high'], bars['low'], bars['close'])
+    state['stream_signal'] = signal
+    return {'Signal': _digest(signal)}
+
+
+def stage_live(state):
+    bars = state['bars']
+    instrument = Instrument('XAUUSD', 5)
+    window = instrument.history_bars
+    signal = np.zeros(len(bars), dtype=np.int8)
+    for i in range(window, len(bars) + 1):
+        signal[i - 1] = instrument.generate_signals(bars[i - window:i])
+    return {'Signal': _digest(signal)}
+
+
+# Stages in pipeline order: (name, function, runs on sizes above STREAM_MAX_BARS)
+STAGES = [
+    ('calculate_indicators', stage_indicators, True),
+    ('generate_signals', stage_signals, True),
+    ('simulate_trading', stage_simulation, True),
+    ('lean_backtest', stage_lean, True),
+    ('stream_signals', stage_stream, False),
+    ('live_generate_signals', stage_live, False),
+]
+
+
+# Function to run the stages once on fresh state, returning each stage's time, peak memory and output summary
+def _run_pipeline(bars, stream_max, trace_memory):
+    state = {'bars': bars, 'data': _frame(bars)}
+    results = {}
+    for name, stage, large in STAGES:
+        if not large and len(bars) > stream_max:
+            continue
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        output = stage(state)
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[name] = {'seconds': seconds, 'peak_bytes': peak, 'output': output}
+
+    # The streaming path must agree with the vectorised signals
+    if 'stream_signal' in state:
+        results['stream_signals']['matches_vectorised'] = bool(np.array_equal(state['stream_signal'],
+                                                                              state['signal'], equal_nan=True))
+    return results
+
+
+# Function to time every stage at each size, keeping the best of the repeats and the peak memory of a separate run
+def run_benchmarks(sizes=SIZES, repeats=3, seed=0, stream_max=STREAM_MAX_BARS):
+    # Compile the numba kernels outside the timings
+    _run_pipeline(synthetic_bars(1000, seed), stream_max, False)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine(), 'seed': seed,
+              'sizes': {}}
+    for n in sizes:
+        bars = synthetic_bars(n, seed)
+        runs = [_run_pipeline(bars, stream_max, False) for _ in range(repeats)]
+        memory = _run_pipeline(bars, stream_max, True)
+        stages = {}
+        for name in runs[0]:
+            stages[name] = {
+                'seconds': min(run[name]['seconds'] for run in runs),
+                'bars_per_second': n / max(min(run[name]['seconds'] for run in runs), 1e-12),
+                'peak_bytes': memory[name]['peak_bytes'],
+                'output': runs[0][name]['output'],
+            }
+            if 'matches_vectorised' in runs[0][name]:
+                stages[name]['matches_vectorised'] = runs[0][name]['matches_vectorised']
+        report['sizes'][str(n)] = stages
+        print(f"{n:>10} bars: " + ", ".join(f"{name} {stage['seconds']:.4f}s" for name, stage in stages.items()))
+    return report
+
+
+def _outputs_match(expected, actual):
+    if isinstance(expected, dict):
+        return all(key in actual and _outputs_match(value, actual[key]) for key, value in expected.items())
+    if isinstance(expected, float):
+        return abs(expected - actual) <= TOLERANCE * max(abs(expected), 1.0)
+    return expected == actual
+
+
+# Function to list the stage outputs that differ from a stored reference
+def check_reference(report, reference):
+    mismatches = []
+    for size, stages in report['sizes'].items():
+        for name, stage in stages.items():
+            expected = reference.get('sizes', {}).get(size, {}).get(name)
+            if expected is not None and not _outputs_match(expected['output'], stage['output']):
+                mismatches.append(f"{name} at {size} bars")
+    return mismatches
+
+
+# Function to list the stages that got slower than a previous run by more than a factor
+def compare_runs(report, previous, threshold=1.2):
+    lines = []
+    for size, stages in report['sizes'].items():
+        for name, stage in stages.items():
+            before = previous.get('sizes', {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            ratio = stage['seconds'] / max(before['seconds'], 1e-12)
+            flag = ' SLOWER' if ratio > threshold else ''
+            lines.append(f"{name:>22} {size:>10}: {before['seconds']:.4f}s -> {stage['seconds']:.4f}s "
+                         f"({ratio:.2f}x){flag}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the indicator, signal and simulation paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stream-max', type=int, default=STREAM_MAX_BARS,
+                        help='Largest size the bar-by-bar stages run on')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--reference', default=REFERENCE_PATH)
+    parser.add_argument('--update-reference', action='store_true', help='Store these outputs as the reference')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare timings against')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.repeats, args.seed, args.stream_max)
+
+    if args.update_reference:
+        os.makedirs(os.path.dirname(args.reference) or '.', exist_ok=True)
+        reference = {'seed': args.seed, 'sizes': {size: {name: {'output': stage['output']}
+                                                         for name, stage in stages.items()}
+                                                  for size, stages in report['sizes'].items()}}
+        with open(args.reference, 'w') as file:
+            json.dump(reference, file, indent=2)
+    elif os.path.exists(args.reference):
+        with open(args.reference) as file:
+            mismatches = check_reference(report, json.load(file))
+        report['reference_mismatches'] = mismatches
+        print("Outputs match the reference" if not mismatches else f"Outputs differ: {', '.join(mismatches)}")
+
+    stream_mismatch = [size for size, stages in report['sizes'].items()
+                       if not stages.get('stream_signals', {}).get('matches_vectorised', True)]
+    if stream_mismatch:
+        print(f"Streaming signals differ from the vectorised ones at {', '.join(stream_mismatch)} bars")
+
+    if args.compare:
+        with open(args.compare) as file:
+            print("\n".join(compare_runs(report, json.load(file))))
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
@@ -0,0 +1,387 @@
+import glob
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+from bar_scheduler import timeframe_seconds
+from bar_store import BarStore, to_bar_records, to_seconds
+
+# Set to a directory of recorded bars (bar store files or SYMBOL_TIMEFRAME.csv/.parquet) to replay instead of MT5
+REPLAY_ENV = 'MT5_REPLAY'
+# Optional replay start time, defaults to just after the last recorded bar
+REPLAY_START_ENV = 'MT5_REPLAY_START'
+
+# Records with the same fields the MetaTrader5 package returns
+Tick = namedtuple('Tick', ['time', 'bid', 'ask', 'last', 'volume', 'time_msc', 'flags', 'volume_real'])
+AccountInfo = namedtuple('AccountInfo', ['login', 'balance', 'equity', 'profit', 'margin', 'margin_free',
+                                         'leverage', 'currency', 'server', 'margin_mode'])
+SymbolInfo = namedtuple('SymbolInfo', ['name', 'point', 'digits', 'trade_contract_size', 'trade_stops_level',
+                                       'volume_min', 'volume_max', 'volume_step', 'bid', 'ask'])
+TradePosition = namedtuple('TradePosition', ['ticket', 'time', 'type', 'magic', 'volume', 'price_open', 'sl', 'tp',
+                                             'price_current', 'profit', 'symbol', 'comment'])
+TradeOrder = namedtuple('TradeOrder', ['ticket', 'time_setup', 'time_done', 'type', 'reason', 'volume_initial',
+                                       'price_open', 'price_current', 'sl', 'tp', 'symbol', 'position_id'])
+OrderSendResult = namedtuple('OrderSendResult', ['retcode', 'deal', 'order', 'volume', 'price', 'bid', 'ask',
+                                                 'comment', 'request'])
+
+
+# Raised by the replay clock once the recorded data runs out
+class ReplayFinished(Exception):
+    pass
+
+
+# Clock used by the live loop when trading against a real terminal
+class SystemClock:
+    @staticmethod
+    def now():
+        return datetime.now()
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+
+# Offline stand-in for the MetaTrader5 module, replaying recorded bars on a simulated clock
+class ReplayTerminal:
+    TIMEFRAME_M1 = 1
+    TIMEFRAME_M5 = 5
+    TIMEFRAME_M15 = 15
+    TIMEFRAME_M30 = 30
+    TIMEFRAME_H1 = 16385
+    TIMEFRAME_H4 = 16388
+    TIMEFRAME_D1 = 16408
+
+    ORDER_TYPE_BUY = 0
+    ORDER_TYPE_SELL = 1
+    POSITION_TYPE_BUY = 0
+    POSITION_TYPE_SELL = 1
+    ORDER_FILLING_FOK = 0
+    ORDER_FILLING_IOC = 1
+    ORDER_FILLING_RETURN = 2
+    ORDER_REASON_CLIENT = 0
+    ORDER_REASON_EXPERT = 3
+    ORDER_REASON_SL = 4
+    ORDER_REASON_TP = 5
+
+    TRADE_ACTION_DEAL = 1
+    TRADE_ACTION_SLTP = 6
+
+    TRADE_RETCODE_REQUOTE = 10004
+    TRADE_RETCODE_DONE = 10009
+    TRADE_RETCODE_DONE_PARTIAL = 10010
+    TRADE_RETCODE_INVALID = 10013
+    TRADE_RETCODE_INVALID_VOLUME = 10014
+    TRADE_RETCODE_MARKET_CLOSED = 10018
+    TRADE_RETCODE_PRICE_CHANGED = 10020
+    TRADE_RETCODE_PRICE_OFF = 10021
+
+    ACCOUNT_MARGIN_MODE_RETAIL_NETTING = 0
+    ACCOUNT_MARGIN_MODE_EXCHANGE = 1
+    ACCOUNT_MARGIN_MODE_RETAIL_HEDGING = 2
+
+    def __init__(self, bars, start=None, balance=10000.0, leverage=100, point=0.01, contract_size=100.0,
+                 margin_mode=ACCOUNT_MARGIN_MODE_RETAIL_HEDGING):
+        # bars maps (symbol, timeframe) to a structured array in the bar store layout
+        self.series = {key: to_bar_records(rates) for key, rates in bars.items()}
+        self.balance = float(balance)
+        self.leverage = leverage
+        self.point = point
+        self.contract_size = contract_size
+        self.margin_mode = margin_mode
+        self.positions = {}
+        self.history = []
+        self.next_ticket = 1
+        self.lock = threading.RLock()
+
+        last_close = max(int(rates['time'][-1]) + timeframe_seconds(timeframe)
+                         for (symbol, timeframe), rates in self.series.items())
+        self.end_time = last_close
+        self.time = last_close if start is None else to_seconds(start)
+
+    @classmethod
+    def from_directory(cls, path, **kwargs):
+        # Imported here so the live bot starts without pandas, which only recorded CSV and parquet bars need
+        import pandas as pd
+
+        bars = {}
+        for file in sorted(glob.glob(os.path.join(path, '*_*.*'))):
+            name, extension = os.path.splitext(os.path.basename(file))
+            symbol, timeframe = name.rsplit('_', 1)
+            if extension == '.bars':
+                rates = BarStore(path).bars(symbol, int(timeframe))
+            elif extension == '.csv':
+                rates = _frame_to_rates(pd.read_csv(file))
+            elif extension == '.parquet':
+                rates = _frame_to_rates(pd.read_parquet(file))
+            else:
+                continue
+            bars[(symbol, int(timeframe))] = rates
+        return cls(bars, **kwargs)
+
+    # Connection calls always succeed offline
+    def initialize(self, *args, **kwargs):
+        return True
+
+    def login(self, *args, **kwargs):
+        return True
+
+    def shutdown(self):
+        return True
+
+    def last_error(self):
+        return 1, 'Success'
+
+    # Clock interface shared with SystemClock
+    def now(self):
+        return datetime.fromtimestamp(self.time, timezone.utc).replace(tzinfo=None)
+
+    def sleep(self, seconds):
+        with self.lock:
+            if self.time >= self.end_time:
+                raise ReplayFinished()
+            target = self.time + int(np.ceil(seconds))
+            self._process_stops(self.time, target)
+            self.time = target
+
+    def _rates(self, symbol, timeframe=None):
+        if timeframe is None:
+            for (series_symbol, series_timeframe), rates in self.series.items():
+                if series_symbol == symbol:
+                    return rates
+            return None
+        return self.series.get((symbol, timeframe))
+
+    # Index of the bar that is open at the given time (-1 before the first bar)
+    def _bar_index(self, rates, at_time):
+        return int(np.searchsorted(rates['time'], at_time, side='right')) - 1
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        rates = self._rates(symbol, timeframe)
+        if rates is None:
+            return None
+        end = self._bar_index(rates, self.time) + 1 - start_pos
+        if end <= 0:
+            return None
+        return np.array(rates[max(end - count, 0):end])
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        rates = self._rates(symbol, timeframe)
+        if rates is None:
+            return None
+        times = rates['time']
+        lo = int(np.searchsorted(times, to_seconds(date_from), side='left'))
+        hi = int(np.searchsorted(times, min(to_seconds(date_to), self.time), side='right'))
+        return np.array(rates[lo:hi])
+
+    def _prices(self, symbol):
+        rates = self._rates(symbol)
+        index = self._bar_index(rates, self.time)
+        if index < 0:
+            return None
+        bar = rates[index]
+        # Within the bar the price is its open, after the last bar it is the final close
+        price = bar['close'] if self.time >= int(bar['time']) + self._bar_seconds(symbol) else bar['open']
+        return float(price), float(price + bar['spread'] * self.point)
+
+    def _bar_seconds(self, symbol):
+        for (series_symbol, timeframe) in self.series:
+            if series_symbol == symbol:
+                return timeframe_seconds(timeframe)
+        return 0
+
+    def symbol_info_tick(self, symbol):
+        prices = self._prices(symbol) if self._rates(symbol) is not None else None
+        if prices is None:
+            return None
+        bid, ask = prices
+        # No ticks arrive in gaps between recorded bars, so the last tick stays inside the last bar
+        rates = self._rates(symbol)
+        bar_end = int(rates['time'][self._bar_index(rates, self.time)]) + self._bar_seconds(symbol)
+        tick_time = min(self.time, bar_end - 1)
+        return Tick(tick_time, bid, ask, bid, 0, tick_time * 1000, 0, 0.0)
+
+    def symbol_select(self, symbol, enable=True):
+        return self._rates(symbol) is not None
+
+    def symbol_info(self, symbol):
+        tick = self.symbol_info_tick(symbol)
+        if tick is None:
+            return None
+        digits = int(round(-np.log10(self.point)))
+        return SymbolInfo(symbol, self.point, digits, self.contract_size, 0, 0.01, 100.0, 0.01, tick.bid, tick.ask)
+
+    def account_info(self):
+        with self.lock:
+            profit = sum(self._position_profit(position) for position in self.positions.values())
+            return AccountInfo(1, self.balance, self.balance + profit, profit, 0.0, self.balance + profit,
+                               self.leverage, 'USD', 'Replay', self.margin_mode)
+
+    def _position_profit(self, position, price=None):
+        if price is None:
+            bid, ask = self._prices(position['symbol'])
+            price = bid if position['type'] == self.ORDER_TYPE_BUY else ask
+        direction = 1 if position['type'] == self.ORDER_TYPE_BUY else -1
+        return direction * (price - position['price_open']) * position['volume'] * self.contract_size
+
+    def positions_get(self, symbol=None, ticket=None):
+        with self.lock:
+            positions = []
+            for position in self.positions.values():
+                if (symbol is not None and position['symbol'] != symbol) or \
+                        (ticket is not None and position['ticket'] != ticket):
+                    continue
+                bid, ask = self._prices(position['symbol'])
+                price = bid if position['type'] == self.ORDER_TYPE_BUY else ask
+                positions.append(TradePosition(position['ticket'], position['time'], position['type'],
+                                               position['magic'], position['volume'], position['price_open'],
+                                               position['sl'], position['tp'], price,
+                                               self._position_profit(position, price), position['symbol'], ''))
+            return tuple(positions)
+
+    def history_orders_get(self, date_from, date_to):
+        lo, hi = to_seconds(date_from), to_seconds(date_to)
+        with self.lock:
+            return tuple(order for order in self.history if lo <= order.time_setup <= hi)
+
+    def _record_order(self, order_type, reason, volume, price, symbol, position_id, sl=0.0, tp=0.0):
+        order = TradeOrder(self.next_ticket, self.time, self.time, order_type, reason, volume, price, price,
+                           sl, tp, symbol, position_id)
+        self.next_ticket += 1
+        self.history.append(order)
+        return order
+
+    def _close_position(self, ticket, price, reason, volume=None):
+        position = self.positions[ticket]
+        volume = position['volume'] if volume is None else min(volume, position['volume'])
+        closing_type = self.ORDER_TYPE_SELL if position['type'] == self.ORDER_TYPE_BUY else self.ORDER_TYPE_BUY
+        self.balance += self._position_profit(dict(position, volume=volume), price)
+        order = self._record_order(closing_type, reason, volume, price, position['symbol'], ticket)
+        position['volume'] = round(position['volume'] - volume, 8)
+        if position['volume'] <= 0:
+            del self.positions[ticket]
+        return order
+
+    def order_send(self, request):
+        with self.lock:
+            action = request.get('action')
+            if action == self.TRADE_ACTION_SLTP:
+                position = self.positions.get(request.get('position'))
+                if position is None:
+                    return OrderSendResult(self.TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, 0.0, 0.0, 'Invalid request',
+                                           request)
+                position['sl'] = float(request.get('sl', position['sl']))
+                position['tp'] = float(request.get('tp', position['tp']))
+                return OrderSendResult(self.TRADE_RETCODE_DONE, 0, 0, 0.0, 0.0, 0.0, 0.0, 'Request executed',
+                                       request)
+
+            if action != self.TRADE_ACTION_DEAL:
+                return OrderSendResult(self.TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, 0.0, 0.0, 'Invalid request',
+                                       request)
+
+            symbol = request['symbol']
+            volume = float(request.get('volume', 0.0))
+            prices = self._prices(symbol) if self._rates(symbol) is not None else None
+            if prices is None or self.time >= self.end_time:
+                return OrderSendResult(self.TRADE_RETCODE_MARKET_CLOSED, 0, 0, 0.0, 0.0, 0.0, 0.0, 'Market closed',
+                                       request)
+            if volume <= 0:
+                return OrderSendResult(self.TRADE_RETCODE_INVALID_VOLUME, 0, 0, 0.0, 0.0, 0.0, 0.0,
+                                       'Invalid volume', request)
+
+            bid, ask = prices
+            order_type = request['type']
+            price = ask if order_type == self.ORDER_TYPE_BUY else bid
+
+            netted = None
+            if self.margin_mode != self.ACCOUNT_MARGIN_MODE_RETAIL_HEDGING and 'position' not in request:
+                # Netting accounts hold one position per symbol, a deal adds to it, reduces it or reverses it
+                netted = next((position for position in self.positions.values() if position['symbol'] == symbol),
+                              None)
+
+            if request.get('position') in self.positions:
+                order = self._close_position(request['position'], price, self.ORDER_REASON_EXPERT, volume)
+            elif netted is not None and netted['type'] == order_type:
+                order = self._record_order(order_type, self.ORDER_REASON_EXPERT, volume, price, symbol,
+                                           netted['ticket'])
+                total = netted['volume'] + volume
+                netted['price_open'] = (netted['price_open'] * netted['volume'] + price * volume) / total
+                netted['volume'] = round(total, 8)
+            elif netted is not None and volume <= netted['volume']:
+                order = self._close_position(netted['ticket'], price, self.ORDER_REASON_EXPERT, volume)
+            else:
+                open_volume = volume
+                if netted is not None:
+                    open_volume = round(volume - netted['volume'], 8)
+                    self._close_position(netted['ticket'], price, self.ORDER_REASON_EXPERT)
+                order = self._record_order(order_type, self.ORDER_REASON_EXPERT, open_volume, price, symbol,
+                                           self.next_ticket, request.get('sl', 0.0), request.get('tp', 0.0))
+                self.positions[order.ticket] = {'ticket': order.ticket, 'time': self.time, 'type': order_type,
+                                                'volume': open_volume, 'price_open': price,
+                                                'sl': float(request.get('sl', 0.0)),
+                                                'tp': float(request.get('tp', 0.0)), 'symbol': symbol,
+                                                'magic': int(request.get('magic', 0))}
+            return OrderSendResult(self.TRADE_RETCODE_DONE, order.ticket, order.ticket, volume, price, bid, ask,
+                                   'Request executed', request)
+
+    # Close positions at market, as mt5.Close does
+    def Close(self, symbol, ticket=None, **kwargs):
+        with self.lock:
+            prices = self._prices(symbol)
+            if prices is None:
+                return False
+            bid, ask = prices
+            tickets = [position['ticket'] for position in self.positions.values()
+                       if position['symbol'] == symbol and (ticket is None or position['ticket'] == ticket)]
+            for position_ticket in tickets:
+                position = self.positions[position_ticket]
+                price = bid if position['type'] == self.ORDER_TYPE_BUY else ask
+                self._close_position(position_ticket, price, self.ORDER_REASON_EXPERT)
+            return len(tickets) > 0
+
+    # Trigger broker-side stop losses and take profits on the bars completed between two times
+    def _process_stops(self, from_time, to_time):
+        for ticket in list(self.positions):
+            position = self.positions[ticket]
+            rates = self._rates(position['symbol'])
+            first = max(self._bar_index(rates, from_time), 0)
+            last = self._bar_index(rates, to_time)
+            for bar in rates[first:last]:
+                spread = bar['spread'] * self.point
+                is_long = position['type'] == self.ORDER_TYPE_BUY
+                sl, tp = position['sl'], position['tp']
+                if sl and ((is_long and bar['low'] <= sl) or (not is_long and bar['high'] + spread >= sl)):
+                    self._close_position(ticket, sl, self.ORDER_REASON_SL)
+                    break
+                if tp and ((is_long and bar['high'] >= tp) or (not is_long and bar['low'] + spread <= tp)):
+                    self._close_position(ticket, tp, self.ORDER_REASON_TP)
+                    break
+
+
+# Function to pick the terminal: the MetaTrader5 package, or a replay of recorded bars when MT5_REPLAY is set
+def load_terminal():
+    replay_path = os.environ.get(REPLAY_ENV)
+    if replay_path:
+        return ReplayTerminal.from_directory(replay_path, start=os.environ.get(REPLAY_START_ENV) or None)
+
+    import MetaTrader5 as mt5
+    return mt5
+
+
+# Function to get the clock matching a terminal, so replays run at full speed
+def terminal_clock(terminal):
+    return terminal if isinstance(terminal, ReplayTerminal) else SystemClock()
+
+
+def _frame_to_rates(data):
+    import pandas as pd
+
+    if data['time'].dtype.kind not in 'iuf':
+        data = data.assign(time=pd.to_datetime(data['time']).astype('datetime64[s]').astype('int64'))
+    for name in ('tick_volume', 'spread', 'real_volume'):
+        if name not in data.columns:
+            data = data.assign(**{name: 0})
+    return to_bar_records(data.to_records(index=False))
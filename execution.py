@@ -0,0 +1,109 @@
+import time
+
+# Return codes worth resending the order for with a fresh price
+RETRY_RETCODES = ('TRADE_RETCODE_REQUOTE', 'TRADE_RETCODE_PRICE_CHANGED', 'TRADE_RETCODE_PRICE_OFF')
+
+
+# Sends market deals for the trading loop, reusing one tick per symbol per cycle and retrying requotes
+class OrderExecutor:
+    def __init__(self, terminal, latency, deadline=2.0, retry_interval=0.05, deviation=20):
+        self.terminal = terminal
+        self.latency = latency
+        self.deadline = deadline  # Seconds allowed for retries of one deal
+        self.retry_interval = retry_interval
+        self.deviation = deviation  # Points of slippage accepted before the broker requotes
+        self.retry_retcodes = {getattr(terminal, name) for name in RETRY_RETCODES if hasattr(terminal, name)}
+        self.ticks = {}
+        self.retries = 0
+
+        account_info = terminal.account_info()
+        hedging = getattr(terminal, 'ACCOUNT_MARGIN_MODE_RETAIL_HEDGING', 2)
+        self.netting = account_info is not None and getattr(account_info, 'margin_mode', hedging) != hedging
+
+    # Forget the ticks of the previous cycle
+    def begin_cycle(self):
+        self.ticks = {}
+
+    # Function to get the latest tick of a symbol, fetched at most once per cycle unless refreshed
+    def tick(self, symbol, refresh=False):
+        if refresh or symbol not in self.ticks:
+            with self.latency.span('symbol_info_tick'):
+                self.ticks[symbol] = self.terminal.symbol_info_tick(symbol)
+        return self.ticks[symbol]
+
+    # Function to send a market deal, resending the unfilled volume after requotes or partial fills until the
+    # deadline, and returning the last result with the filled volume and its average price
+    def send_deal(self, symbol, order_type, volume, magic=0, position=None):
+        is_buy = order_type == self.terminal.ORDER_TYPE_BUY
+        deadline = time.monotonic() + self.deadline
+        remaining = volume
+        filled = 0.0
+        filled_value = 0.0
+        result = None
+        attempt = 0
+
+        while True:
+            tick = self.tick(symbol, refresh=attempt > 0)
+            if tick is None:
+                break
+            request = {
+                "action": self.terminal.TRADE_ACTION_DEAL,
+                "symbol": symbol,
+                "volume": remaining,
+                "price": tick.ask if is_buy else tick.bid,
+                "deviation": self.deviation,
+                "type": order_type,
+                "type_filling": self.terminal.ORDER_FILLING_IOC,  # immediate or cancel
+                "magic": magic,
+            }
+            if position is not None:
+                request["position"] = position
+
+            with self.latency.span('order_send'):
+                result = self.terminal.order_send(request)
+            attempt += 1
+
+            retcode = result.retcode if result is not None else None
+            if retcode in (self.terminal.TRADE_RETCODE_DONE, getattr(self.terminal, 'TRADE_RETCODE_DONE_PARTIAL',
+                                                                      None)):
+                # IOC fills what it can, the rest of the volume is sent again
+                done = result.volume if retcode != self.terminal.TRADE_RETCODE_DONE else remaining
+                filled += done
+                filled_value += done * result.price
+                remaining = round(remaining - done, 8)
+            elif result is not None and retcode not in self.retry_retcodes:
+                break
+
+            if remaining <= 0 or time.monotonic() >= deadline:
+                break
+            self.retries += 1
+            time.sleep(self.retry_interval)
+
+        return result, filled, filled_value / filled if filled else 0.0
+
+    # Function to move an instrument to the target side, closing the opposite positions and opening volume
+    # Returns the (position, filled volume, price) of each close and the (result, filled volume, price) of the open,
+    # which is (None, 0.0, 0.0) when no volume is opened or an opposite position did not close in full
+    def reverse(self, symbol, direction, opposite, volume, magic=0):
+        order_type = self.terminal.ORDER_TYPE_BUY if direction > 0 else self.terminal.ORDER_TYPE_SELL
+        if self.netting:
+            # One deal for the closing and opening volume, so the account is never left flat in between
+            closing = sum(position.volume for position in opposite)
+            result, filled, price = self.send_deal(symbol, order_type, round(closing + volume, 8), magic)
+            closes = []
+            for position in opposite:
+                closed = min(position.volume, filled)
+                filled = round(filled - closed, 8)
+                closes.append((position, closed, price))
+            return closes, (result, filled, price)
+
+        # Hedging accounts close each position by ticket, then open, without reading prices or balance in between
+        closes = []
+        for position in opposite:
+            result, filled, price = self.send_deal(symbol, order_type, position.volume, magic, position.ticket)
+            closes.append((position, filled, price))
+
+        # Opening with an opposite position still open would hold both sides, sized from profit never realised
+        if volume <= 0 or any(round(position.volume - filled, 8) > 0 for position, filled, price in closes):
+            return closes, (None, 0.0, 0.0)
+        return closes, self.send_deal(symbol, order_type, volume, magic)
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+QUANTILES = (0.5, 0.99)
+
+
+# Fixed-size ring of the most recent samples of one stage, in seconds
+class LatencyHistogram:
+    __slots__ = ('samples', 'count', 'total', 'max')
+
+    def __init__(self, max_samples):
+        self.samples = np.zeros(max_samples)
+        self.count = 0  # Samples ever recorded, the ring holds the last max_samples of them
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        recent = self.samples[:min(self.count, len(self.samples))]
+        p50, p99 = np.quantile(recent, QUANTILES) if len(recent) else (0.0, 0.0)
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.0,
+                'p50': float(p50), 'p99': float(p99), 'max': self.max}
+
+
+# Times named stages of the trading loop and keeps a latency histogram for each
+class LatencyRecorder:
+    def __init__(self, max_samples=10000, path=None, interval=60.0, tick_to_order=False, max_signals=1000):
+        self.max_samples = max_samples
+        self.path = path  # .prom for Prometheus text, anything else for JSON
+        self.interval = interval
+        self.tick_to_order = tick_to_order  # Record the latency from the bar-closing tick to each order
+        self.histograms = {}
+        self.signals = deque(maxlen=max_signals)
+        self.lock = threading.Lock()
+        self.last_write = time.monotonic()
+        self.server = None
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram(self.max_samples)
+            histogram.record(seconds)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # Record the latency from the tick that closed a bar to the order it triggered
+    def record_signal(self, symbol, bar_time, seen_at, tick_msc, order_tick_msc):
+        if not self.tick_to_order:
+            return
+        seconds = time.perf_counter() - seen_at
+        self.record('tick_to_order', seconds)
+        with self.lock:
+            self.signals.append({'symbol': symbol, 'bar_time': int(bar_time), 'seconds': seconds,
+                                 'server_ms': int(order_tick_msc - tick_msc)})
+
+    def summary(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    # Function to format the histograms as Prometheus summaries
+    def prometheus_text(self):
+        summary = sorted(self.summary().items())
+        lines = ['# HELP fxalgo_stage_seconds Latency of each stage of the trading loop',
+                 '# TYPE fxalgo_stage_seconds summary']
+        for name, stats in summary:
+            for quantile, key in zip(QUANTILES, ('p50', 'p99')):
+                lines.append(f'fxalgo_stage_seconds{{stage="{name}",quantile="{quantile}"}} {stats[key]:.9f}')
+            lines.append(f'fxalgo_stage_seconds_sum{{stage="{name}"}} {stats["mean"] * stats["count"]:.9f}')
+            lines.append(f'fxalgo_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        lines += ['# HELP fxalgo_stage_seconds_max Slowest run of each stage of the trading loop',
+                  '# TYPE fxalgo_stage_seconds_max gauge']
+        for name, stats in summary:
+            lines.append(f'fxalgo_stage_seconds_max{{stage="{name}"}} {stats["max"]:.9f}')
+        return '\n'.join(lines) + '\n'
+
+    # Write the histograms to a file, replacing it atomically so readers never see a partial dump
+    def write(self, path=None):
+        path = path or self.path
+        if path.endswith('.prom'):
+            content = self.prometheus_text()
+        else:
+            with self.lock:
+                signals = list(self.signals)
+            content = json.dumps({'stages': self.summary(), 'signals': signals}, indent=2)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+    # Write the histograms if a path is set and the interval has passed since the last write
+    def maybe_write(self):
+        if self.path is None or time.monotonic() - self.last_write < self.interval:
+            return
+        self.last_write = time.monotonic()
+        try:
+            self.write()
+        except OSError as e:
+            print(f"Failed to write latency stats: {e}")
+
+    # Serve the Prometheus text on http://host:port/metrics from a background thread
+    def serve(self, port, host='127.0.0.1'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path is not None:
+            self.write()
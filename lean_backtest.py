@@ -0,0 +1,286 @@
+import argparse
+import math
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from backtest_engine import WARMUP_BARS, njit
+from bar_store import BAR_DTYPE
+
+CHUNK_BARS = 1_000_000
+
+# Rolling mean state slots, the same Kahan summation as pandas rolling().mean() and streaming_indicators.RollingMean
+NOBS, SUM_X, NEG_CT, COMPENSATION_ADD, COMPENSATION_REMOVE, SAME_VALUE_COUNT, PREV_VALUE, HAS_PREV, RING_COUNT, \
+    RING_POS = range(10)
+
+# Strategy state slots, as in streaming_indicators.MAExtremaStream
+MA, PREVIOUS_MA, SECOND_PREVIOUS_MA, PREVIOUS_CLOSE, HAS_CLOSE, ATR, PREVIOUS_ATR, LAST_EXTREMA, HAS_LAST, \
+    SCND_LAST_EXTREMA, HAS_SCND_LAST, PENDING_SIGNAL, BARS = range(13)
+
+# Simulation state slots, as in backtest_engine.simulate_trading_kernel
+CAPITAL, POSITION, HAS_STOP, STOP_LOSS, OPEN_PRICE, OPEN_INDEX, PROFITABLE_SIGNALS, TOTAL_SIGNALS = range(8)
+
+LeanResult = namedtuple('LeanResult', ['signal', 'profitable', 'stop_index', 'stop_price', 'balance', 'capital',
+                                       'profitable_signals', 'total_signals'])
+
+
+# Function to add one value to a rolling mean kept in a state array and a ring of the window's values
+@njit(cache=True)
+def _rolling_mean_update(state, ring, value, min_periods):
+    window = len(ring)
+    if state[HAS_PREV] == 0:
+        state[PREV_VALUE] = value
+        state[HAS_PREV] = 1
+
+    count = int(state[RING_COUNT])
+    pos = int(state[RING_POS])
+    if count == window:
+        old = ring[pos]
+        if old == old:
+            state[NOBS] -= 1
+            y = -old - state[COMPENSATION_REMOVE]
+            t = state[SUM_X] + y
+            state[COMPENSATION_REMOVE] = t - state[SUM_X] - y
+            state[SUM_X] = t
+            if math.copysign(1.0, old) < 0:
+                state[NEG_CT] -= 1
+    else:
+        state[RING_COUNT] = count + 1
+    ring[pos] = value
+    state[RING_POS] = (pos + 1) % window
+
+    if value == value:
+        state[NOBS] += 1
+        y = value - state[COMPENSATION_ADD]
+        t = state[SUM_X] + y
+        state[COMPENSATION_ADD] = t - state[SUM_X] - y
+        state[SUM_X] = t
+        if math.copysign(1.0, value) < 0:
+            state[NEG_CT] += 1
+        if value == state[PREV_VALUE]:
+            state[SAME_VALUE_COUNT] += 1
+        else:
+            state[SAME_VALUE_COUNT] = 1
+        state[PREV_VALUE] = value
+
+    nobs = state[NOBS]
+    if nobs < min_periods or nobs == 0:
+        return np.nan
+    result = state[SUM_X] / nobs
+    if state[SAME_VALUE_COUNT] >= nobs:
+        result = state[PREV_VALUE]
+    elif state[NEG_CT] == 0 and result < 0:
+        result = 0.0
+    elif state[NEG_CT] == nobs and result > 0:
+        result = 0.0
+    return result
+
+
+# Function to run indicators, signals and the simulation bar by bar over one chunk, carrying every state array
+# to the next chunk so no full-length intermediate column is ever built
+@njit(cache=True)
+def lean_chunk_kernel(offset, open_prices, high, low, close, spread, volatility_threshold, leverage, risk,
+                      ma_state, ma_ring, atr_state, atr_ring, strategy, sim, signal_out, profitable_out, balance_out,
+                      stop_index, stop_price):
+    stops = 0
+    atr_period = len(atr_ring)
+
+    for k in range(len(close)):
+        g = offset + k
+
+        # Simulation of bar g with the signal from bar g - 1 and the MA of bar g - 2, as the kernel on data[9:]
+        if g >= WARMUP_BARS:
+            i = g - WARMUP_BARS
+            signal = strategy[PENDING_SIGNAL]
+            capital = sim[CAPITAL]
+            position = sim[POSITION]
+            open_price = sim[OPEN_PRICE]
+            buy_price = open_prices[k] + spread[k] / (2 * 100)
+            sell_price = open_prices[k] - spread[k] / (2 * 100)
+
+            if position > 0:
+                profit_loss = position * (sell_price - open_price)
+            elif position < 0:
+                profit_loss = position * (buy_price - open_price)
+            else:
+                profit_loss = 0.0
+
+            if len(balance_out) > 0:
+                balance_out[i] = capital + profit_loss
+
+            if signal == 1 or signal == -1:
+                if (signal == 1 and position < 0) or (signal == -1 and position > 0):
+                    capital += profit_loss
+                    position = 0.0
+                    if profit_loss > 0:
+                        sim[PROFITABLE_SIGNALS] += 1
+                        profitable_out[int(sim[OPEN_INDEX])] = 1
+                    else:
+                        profitable_out[int(sim[OPEN_INDEX])] = 0
+                if position == 0:
+                    open_price = buy_price if signal == 1 else sell_price
+                    position = (risk * capital * leverage) / open_price
+                    if signal == -1:
+                        position = -position
+                    sim[OPEN_INDEX] = i
+                sim[TOTAL_SIGNALS] += 1
+
+            if profit_loss > 0 and i > 1:
+                new_stop_loss = strategy[PREVIOUS_MA]
+                if position > 0:
+                    if sim[HAS_STOP] == 0 or new_stop_loss > sim[STOP_LOSS]:
+                        sim[STOP_LOSS] = new_stop_loss
+                        sim[HAS_STOP] = 1
+                elif position < 0:
+                    if sim[HAS_STOP] == 0 or new_stop_loss < sim[STOP_LOSS]:
+                        sim[STOP_LOSS] = new_stop_loss
+                        sim[HAS_STOP] = 1
+
+            if sim[HAS_STOP] != 0:
+                stop_loss = sim[STOP_LOSS]
+                if (position > 0 and low[k] < stop_loss) or (position < 0 and high[k] > stop_loss):
+                    profit_loss = position * (stop_loss - open_price)
+                    capital += profit_loss
+                    stop_index[stops] = i
+                    stop_price[stops] = stop_loss
+                    stops += 1
+                    position = 0.0
+                    sim[HAS_STOP] = 0
+                    if profit_loss > 0:
+                        sim[PROFITABLE_SIGNALS] += 1
+                        profitable_out[int(sim[OPEN_INDEX])] = 1
+                    else:
+                        profitable_out[int(sim[OPEN_INDEX])] = 0
+
+            sim[CAPITAL] = capital
+            sim[POSITION] = position
+            sim[OPEN_PRICE] = open_price
+
+        # Indicators and the MA extrema signal of bar g, traded at the open of bar g + 1
+        extrema_close = strategy[PREVIOUS_CLOSE]
+        strategy[SECOND_PREVIOUS_MA] = strategy[PREVIOUS_MA]
+        strategy[PREVIOUS_MA] = strategy[MA]
+        strategy[MA] = _rolling_mean_update(ma_state, ma_ring, close[k], 1)
+        if strategy[HAS_CLOSE] == 0:
+            true_range = np.nan
+        else:
+            previous_close = strategy[PREVIOUS_CLOSE]
+            true_range = max(high[k] - low[k], max(abs(high[k] - previous_close), abs(low[k] - previous_close)))
+        strategy[PREVIOUS_ATR] = strategy[ATR]
+        strategy[ATR] = _rolling_mean_update(atr_state, atr_ring, true_range, atr_period)
+        strategy[PREVIOUS_CLOSE] = close[k]
+        strategy[HAS_CLOSE] = 1
+        strategy[BARS] += 1
+
+        bar_signal = 0
+        if strategy[BARS] >= 3:
+            previous_ma = strategy[PREVIOUS_MA]
+            if previous_ma < strategy[SECOND_PREVIOUS_MA] and previous_ma < strategy[MA]:
+                bar_signal = 1
+            elif previous_ma > strategy[SECOND_PREVIOUS_MA] and previous_ma > strategy[MA]:
+                bar_signal = -1
+
+            if bar_signal != 0:
+                strategy[SCND_LAST_EXTREMA] = strategy[LAST_EXTREMA]
+                strategy[HAS_SCND_LAST] = strategy[HAS_LAST]
+                strategy[LAST_EXTREMA] = previous_ma
+                strategy[HAS_LAST] = 1
+
+                if not strategy[PREVIOUS_ATR] < volatility_threshold * extrema_close:
+                    bar_signal = 0
+                elif strategy[HAS_SCND_LAST] != 0:
+                    distance_extrema = abs(strategy[LAST_EXTREMA] - strategy[SCND_LAST_EXTREMA])
+                    if abs(close[k] - strategy[MA]) >= distance_extrema:
+                        bar_signal = 0
+
+        # The first two bars never carry a signal, as in generate_signal_array
+        strategy[PENDING_SIGNAL] = bar_signal if g >= 1 else np.nan
+        if len(signal_out) > 0 and g + 1 < len(signal_out):
+            signal_out[g + 1] = bar_signal
+
+    return stops
+
+
+# Function to yield (start, chunk) pieces of bars held in memory, or read piece by piece from a .bars file path
+def iter_bar_chunks(bars, chunk_size=CHUNK_BARS):
+    if isinstance(bars, str):
+        count = os.path.getsize(bars) // BAR_DTYPE.itemsize
+        for start in range(0, count, chunk_size):
+            yield start, np.fromfile(bars, dtype=BAR_DTYPE, count=min(chunk_size, count - start),
+                                     offset=start * BAR_DTYPE.itemsize)
+    else:
+        for start in range(0, len(bars), chunk_size):
+            yield start, bars[start:start + chunk_size]
+
+
+def _bar_count(bars):
+    return os.path.getsize(bars) // BAR_DTYPE.itemsize if isinstance(bars, str) else len(bars)
+
+
+# Function to pull one column of a chunk as a contiguous float64 array
+def _column(chunk, name):
+    return np.ascontiguousarray(chunk[name], dtype=np.float64)
+
+
+# Function to backtest a long bar history in chunks with a small, fixed working set. bars is a structured array
+# in the bar store layout, a DataFrame, or the path of a .bars file, which is then read one chunk at a time.
+# Results match run_simulation on the WARMUP_BARS slice: profitable is int8 with -1 where the column is NaN
+def backtest_lean(bars, short_window=10, atr_period=14, volatility_threshold=0.001, initial_capital=10000,
+                  leverage=100, risk=0.01, chunk_size=CHUNK_BARS, keep_balance=True, keep_signal=True):
+    n = _bar_count(bars)
+    simulated = max(n - WARMUP_BARS, 0)
+
+    ma_state, ma_ring = np.zeros(10), np.zeros(short_window)
+    atr_state, atr_ring = np.zeros(10), np.zeros(atr_period)
+    strategy = np.zeros(13)
+    strategy[[MA, PREVIOUS_MA, SECOND_PREVIOUS_MA, ATR, PREVIOUS_ATR, PENDING_SIGNAL]] = np.nan
+    sim = np.zeros(8)
+    sim[CAPITAL] = initial_capital
+    sim[OPEN_INDEX] = -1
+
+    signal = np.zeros(n if keep_signal else 0, dtype=np.int8)
+    profitable = np.full(simulated, -1, dtype=np.int8)
+    balance = np.empty(simulated if keep_balance else 0)
+    stop_buffer_index = np.empty(min(chunk_size, n), dtype=np.int64)
+    stop_buffer_price = np.empty(min(chunk_size, n))
+    stop_indexes, stop_prices = [], []
+
+    for start, chunk in iter_bar_chunks(bars, chunk_size):
+        stops = lean_chunk_kernel(start, _column(chunk, 'open'), _column(chunk, 'high'), _column(chunk, 'low'),
+                                  _column(chunk, 'close'), _column(chunk, 'spread'), float(volatility_threshold),
+                                  float(leverage), float(risk), ma_state, ma_ring, atr_state, atr_ring, strategy,
+                                  sim, signal, profitable, balance, stop_buffer_index, stop_buffer_price)
+        stop_indexes.append(stop_buffer_index[:stops].copy())
+        stop_prices.append(stop_buffer_price[:stops].copy())
+
+    return LeanResult(signal, profitable, np.concatenate(stop_indexes) if stop_indexes else np.empty(0, np.int64),
+                      np.concatenate(stop_prices) if stop_prices else np.empty(0), balance, sim[CAPITAL],
+                      int(sim[PROFITABLE_SIGNALS]), int(sim[TOTAL_SIGNALS]))
+
+
+if __name__ == "__main__":
+    from bar_store import BarStore
+
+    parser = argparse.ArgumentParser(description='Low-memory backtest over the bars in the local bar store')
+    parser.add_argument('symbol')
+    parser.add_argument('--timeframe', type=int, default=5, help='MT5 timeframe constant, 5 for M5')
+    parser.add_argument('--root', default='bar_data')
+    parser.add_argument('--chunk-bars', type=int, default=CHUNK_BARS)
+    parser.add_argument('--volatility-threshold', type=float, default=0.001)
+    parser.add_argument('--risk', type=float, default=0.01)
+    args = parser.parse_args()
+
+    path = BarStore(args.root).path(args.symbol, args.timeframe)
+    result = backtest_lean(path, volatility_threshold=args.volatility_threshold, risk=args.risk,
+                           chunk_size=args.chunk_bars, keep_balance=False, keep_signal=False)
+    print(f"Bars: {_bar_count(path)}")
+    print(f"Final Capital: {result.capital}")
+    print(f"Total Signals: {result.total_signals}")
+    print(f"Profitable Signals: {result.profitable_signals}")
+    print(f"Stop Losses Hit: {len(result.stop_index)}")
+    try:
+        import resource  # Unix only, the MT5 terminal runs on Windows
+        print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    except ImportError:
+        pass
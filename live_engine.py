@@ -0,0 +1,398 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from bar_scheduler import BarCloseScheduler
+from execution import OrderExecutor
+from latency import LatencyRecorder
+from position_book import PositionBook
+from stop_monitor import StopLossMonitor
+from streaming_indicators import MAExtremaStream
+from trade_ledger import EXIT_SIGNAL, EXIT_STOP_LOSS, TradeLedger
+
+
+# Strategy state and settings for one symbol and timeframe
+class Instrument:
+    def __init__(self, symbol, timeframe, risk=0.01, short_window=10, history_bars=12, sl_digits=3, magic=0,
+                 warmup_bars=1000, min_stop_step=None):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.risk = risk
+        self.short_window = short_window
+        self.history_bars = history_bars
+        self.warmup_bars = warmup_bars  # Bars run through the strategy at startup to seed its extrema history
+        self.warmed_up = False
+        self.sl_digits = sl_digits
+        self.min_stop_step = min_stop_step  # Smallest stop loss move worth a modification, None for one tick
+        self.stop_distance = 0.0  # Closest the broker allows a stop loss to the price
+        self.point = 10.0 ** -sl_digits  # Price step of the symbol, the least gap kept between a stop and the price
+        self.magic = magic
+        self.stream = MAExtremaStream(short_window=short_window)
+        self.last_bar_time = None
+        self.scheduler = None
+        self.volume_step = 0.01
+        self.contract_size = 1.0
+
+    # Key of the instrument's state in a snapshot
+    def state_key(self):
+        return self.symbol, self.timeframe, self.magic
+
+    def snapshot(self):
+        return {'stream': self.stream, 'last_bar_time': self.last_bar_time}
+
+    # Function to carry on from a saved state, unless it was built with other settings
+    def restore(self, snapshot):
+        stream = snapshot['stream']
+        if type(stream) is not type(self.stream) or stream.ma_mean.window != self.stream.ma_mean.window or \
+                stream.volatility_threshold != self.stream.volatility_threshold:
+            return False
+        self.stream = stream
+        self.last_bar_time = snapshot['last_bar_time']
+        return True
+
+    # Bars to fetch for the next update: the warm-up history on the first one, afterwards the recent bars
+    def bars_needed(self):
+        return self.history_bars if self.warmed_up else max(self.warmup_bars, self.history_bars)
+
+    # Function to feed the completed bars not seen yet into the streaming strategy state
+    def generate_signals(self, rates):
+        if self.last_bar_time is not None and not rates['time'][0] <= self.last_bar_time <= rates['time'][-1]:
+            # The state does not join onto these rates (bars were missed), so start again from the rates. Unless
+            # they are already the warm-up history, no signal is given until it is fetched at the next bar
+            print(f"Saved state of {self.symbol} does not join onto the bars fetched, starting from the latest bars")
+            self.stream = MAExtremaStream(short_window=self.short_window)
+            self.last_bar_time = None
+            if self.warmed_up:
+                self.warmed_up = False
+                return 0
+
+        # From a cold start every bar is run through the strategy, seeding the extrema and held signals the way
+        # the backtester has them, then only the new bars are
+        new_bars = rates if self.last_bar_time is None else rates[rates['time'] > self.last_bar_time]
+        signal = self.stream.update_many(new_bars['high'], new_bars['low'], new_bars['close'])
+        self.last_bar_time = int(rates['time'][-1])
+        self.warmed_up = True
+
+        return signal
+
+
+# Drives any number of instruments from one terminal connection
+class LiveEngine:
+    def __init__(self, terminal, clock, instruments, notify, ledger=None, latency=None, executor=None, state=None):
+        self.terminal = terminal
+        self.clock = clock
+        self.instruments = instruments
+        self.notify = notify
+        self.ledger = ledger if ledger is not None else TradeLedger()
+        self.latency = latency if latency is not None else LatencyRecorder()
+        self.executor = executor if executor is not None else OrderExecutor(terminal, self.latency)
+        self.state = state  # StateStore the strategy state is saved to after every bar, None to keep none
+        self.open_trades = {}  # Position ticket to (symbol, direction, entry time, entry price, size)
+        self.book = PositionBook(terminal.ORDER_TYPE_BUY)
+        self.account_balance = None
+        # Positions are told apart by symbol and magic number, so two instruments sharing both would close each
+        # other's positions and trail each other's stops
+        keys = [(instrument.symbol, instrument.magic) for instrument in instruments]
+        duplicates = sorted({key for key in keys if keys.count(key) > 1})
+        if duplicates:
+            raise ValueError(f"Instruments need distinct magic numbers per symbol: {duplicates}")
+        self.stop_loss_monitor = StopLossMonitor(terminal, [instrument.symbol for instrument in instruments],
+                                                 on_stop_loss=self.notify_stop_loss)
+
+        for instrument in instruments:
+            terminal.symbol_select(instrument.symbol, True)
+            info = terminal.symbol_info(instrument.symbol)
+            if info is not None:
+                instrument.volume_step = info.volume_step
+                instrument.contract_size = info.trade_contract_size
+                instrument.stop_distance = info.trade_stops_level * info.point
+                instrument.point = info.point
+            if instrument.min_stop_step is None:
+                # A move of less than a tick leaves the stop where it was
+                tick_size = getattr(info, 'trade_tick_size', 0.0) if info is not None else 0.0
+                instrument.min_stop_step = max(instrument.point, tick_size)
+            instrument.scheduler = BarCloseScheduler(terminal, instrument.symbol, instrument.timeframe, clock)
+            instrument.scheduler.on_market_closed = \
+                lambda symbol=instrument.symbol: self.notify("Market Status", f"{symbol} market has closed.")
+            instrument.scheduler.on_market_reopened = \
+                lambda symbol=instrument.symbol: self.notify("Market Status", f"{symbol} market has reopened.")
+
+    # Function to notify when the stop loss monitor sees a stop loss triggered
+    def notify_stop_loss(self, event):
+        order_type = "Buy" if event.type == self.terminal.ORDER_TYPE_BUY else "Sell"
+        self.notify("Stop Loss Triggered",
+                    f"{order_type} {event.symbol} order {event.position_id} stopped out at {event.price}")
+
+    # Function to get account balance
+    def get_account_balance(self):
+        with self.latency.span('account_info'):
+            account_info = self.terminal.account_info()
+        return account_info.balance if account_info is not None else None
+
+    # Function to calculate an order size from a percentage of account capital and the instrument's volume step
+    def order_size(self, instrument, action, capital=None):
+        capital = self.account_balance if capital is None else capital
+        if capital is None:
+            return None
+        tick = self.executor.tick(instrument.symbol)
+        if tick is None:
+            price_name = 'ask' if action == 'BUY' else 'bid'
+            self.notify('Error', f"Failed to retrieve current {price_name} price for {instrument.symbol}")
+            return None
+        current_price = tick.ask if action == 'BUY' else tick.bid
+        order_volume = capital * instrument.risk / current_price
+        steps_per_lot = round(1 / instrument.volume_step)
+        return float(np.floor(order_volume * steps_per_lot) / steps_per_lot)
+
+    # Function to calculate buy order size based on a percentage of account capital
+    def buy_order_size(self, instrument, capital=None):
+        return self.order_size(instrument, 'BUY', capital)
+
+    # Function to calculate sell order size based on a percentage of account capital
+    def sell_order_size(self, instrument, capital=None):
+        return self.order_size(instrument, 'SELL', capital)
+
+    # Function to move an instrument to the side of a signal: close the opposite positions and open a new one,
+    # unless a position on that side is already open
+    def execute_signal(self, instrument, action, positions):
+        direction = 1 if action == 'BUY' else -1
+        target_type = self.terminal.ORDER_TYPE_BUY if action == 'BUY' else self.terminal.ORDER_TYPE_SELL
+        own = [position for position in positions
+               if position.symbol == instrument.symbol and position.magic == instrument.magic]
+        opposite = [position for position in own if position.type != target_type]
+        if len(own) > len(opposite):
+            size = 0.0
+            print(f"{action.capitalize()} position already open on {instrument.symbol}")
+        else:
+            # Sized from the balance left once the opposite positions close, so the balance is read once a cycle
+            capital = None if self.account_balance is None else \
+                self.account_balance + sum(position.profit for position in opposite)
+            size = self.buy_order_size(instrument, capital) if action == 'BUY' else \
+                self.sell_order_size(instrument, capital)
+            if size is None:
+                print(f"Unable to retrieve account capital or price for {instrument.symbol}")
+                size = 0.0
+            elif size > 0:
+                print(f"Placing {action.capitalize()} Order on {instrument.symbol}, Size: {size}")
+        if not opposite and size <= 0:
+            return
+
+        closes, (result, filled, price) = self.executor.reverse(instrument.symbol, direction, opposite, size,
+                                                                instrument.magic)
+
+        closed_type = 'SELL' if action == 'BUY' else 'BUY'
+        for position, closed_volume, close_price in closes:
+            if closed_volume > 0:
+                self.book.close(position.ticket, closed_volume)
+                self.record_close(instrument, position, closed_volume, close_price)
+                self.notify("Position Closed", f"Closed previous {closed_type} {instrument.symbol} position")
+            else:
+                self.notify("Order Failed", f"Failed to close {closed_type} {instrument.symbol} position "
+                                            f"{position.ticket}")
+
+        if size <= 0:
+            return
+        if any(round(position.volume - closed_volume, 8) > 0 for position, closed_volume, close_price in closes):
+            self.notify("Order Failed", f"Skipped {action} {instrument.symbol} order, previous {closed_type} "
+                                        f"position not fully closed")
+            return
+        if filled > 0:
+            tick = self.executor.tick(instrument.symbol)
+            scheduler = instrument.scheduler
+            if scheduler.closed_seen_at is not None:
+                self.latency.record_signal(instrument.symbol, scheduler.closed_bar, scheduler.closed_seen_at,
+                                           scheduler.closed_tick_msc, tick.time_msc)
+            self.notify("Order Executed", f"Position {action} {filled} {instrument.symbol} opened")
+        else:
+            retcode = result.retcode if result is not None else None
+            self.notify("Order Failed", f"Failed to execute {action} {instrument.symbol} order, retcode={retcode}")
+
+    # Function to add a position closed at market to the trade ledger
+    def record_close(self, instrument, position, volume, exit_price):
+        tick = self.executor.tick(instrument.symbol)
+        exit_time = tick.time if tick is not None else position.time
+        direction = 1 if position.type == self.terminal.ORDER_TYPE_BUY else -1
+        size = volume * instrument.contract_size
+        if volume >= position.volume:
+            self.open_trades.pop(position.ticket, None)
+        self.ledger.append(position.ticket, instrument.symbol, direction, position.time, exit_time,
+                           position.price_open, exit_price, size, direction * size * (exit_price - position.price_open),
+                           EXIT_SIGNAL)
+
+    # Function to remember the entry details of the open positions, for the ledger when their stop losses fire
+    def track_positions(self, positions):
+        for position in positions:
+            for instrument in self.instruments:
+                if position.symbol == instrument.symbol and position.magic == instrument.magic:
+                    self.open_trades[position.ticket] = (
+                        position.symbol, 1 if position.type == self.terminal.ORDER_TYPE_BUY else -1, position.time,
+                        position.price_open, position.volume * instrument.contract_size)
+
+    # Function to add a position closed by its stop loss to the trade ledger
+    def record_stop_loss(self, event):
+        # The stop loss order is on the opposite side of the position it closed
+        direction = 1 if event.type == self.terminal.ORDER_TYPE_SELL else -1
+        symbol, _, entry_time, entry_price, size = self.open_trades.pop(
+            event.position_id, (event.symbol, direction, 0, np.nan, np.nan))
+        if np.isnan(size):
+            contract_size = next((instrument.contract_size for instrument in self.instruments
+                                  if instrument.symbol == event.symbol), 1.0)
+            size = event.volume * contract_size
+        self.ledger.append(event.position_id, symbol, direction, entry_time, event.time, entry_price, event.price,
+                           size, direction * size * (event.price - entry_price), EXIT_STOP_LOSS)
+
+    def sl_change(self, ticket, new_sl):
+        request = {
+            "action": self.terminal.TRADE_ACTION_SLTP,
+            "position": ticket,
+            "sl": new_sl,
+        }
+
+        # Send the request to modify the stop loss
+        with self.latency.span('sl_change'):
+            result = self.terminal.order_send(request)
+
+        # Check if the modification was successful
+        if not result.retcode == self.terminal.TRADE_RETCODE_DONE:
+            print(f"Failed to modify stop loss for position {ticket}, retcode={result.retcode}")
+            self.notify('Error', f"Failed to modify stop loss for position {ticket}, retcode={result.retcode}")
+        else:
+            self.book.set_stop(ticket, new_sl)
+
+    # Function to trail the stop loss of profitable positions behind the previous MA value, sending only the
+    # modifications that move a stop by at least the instrument's minimum step
+    def update_stop_losses(self, instrument):
+        tickets, stops = self.book.trailing_stops(instrument.symbol, instrument.magic, instrument.stream.previous_ma,
+                                                  instrument.sl_digits, instrument.min_stop_step,
+                                                  instrument.stop_distance, instrument.point)
+        for ticket, stop in zip(tickets.tolist(), stops.tolist()):
+            self.sl_change(ticket, stop)
+
+    # Function to handle the bars that just closed for a group of instruments in one pass
+    def process(self, instruments):
+        # Stop losses triggered since the last bar, polled here too so none are missing from the ledger
+        with self.latency.span('stop_loss_poll'):
+            self.stop_loss_monitor.poll()
+        for event in self.stop_loss_monitor.drain():
+            print(f"{event.symbol} position {event.position_id} stopped out at {event.price}")
+            self.record_stop_loss(event)
+
+        # Get the last completed bars of each instrument, excluding the current bar
+        signals = []
+        for instrument in instruments:
+            with self.latency.span('copy_rates'):
+                rates = instrument.scheduler.copy_closed_rates(instrument.bars_needed())
+            if rates is None or len(rates) == 0:
+                continue
+            with self.latency.span('generate_signals'):
+                signal = instrument.generate_signals(rates)
+            if signal != 0:
+                signals.append((instrument, 'BUY' if signal > 0 else 'SELL'))
+
+        # Positions and ticks are read once for the cycle, the book follows the deals sent after that. Positions
+        # opened this cycle join it at the next refresh, they are not in profit yet so have no stop to trail
+        self.executor.begin_cycle()
+        with self.latency.span('positions_get'):
+            self.book.refresh(self.terminal.positions_get() or ())
+        self.track_positions(self.book.positions)
+
+        if signals:
+            # The balance is read once for the cycle and every deal is sent back to back
+            self.account_balance = self.get_account_balance()
+            for instrument, action in signals:
+                self.execute_signal(instrument, action, self.book.positions)
+
+        with self.latency.span('update_stop_losses'):
+            for instrument in instruments:
+                self.update_stop_losses(instrument)
+
+    # Block until at least one instrument's bar has closed and return those instruments
+    def wait_for_bar_closes(self):
+        while True:
+            now = self.clock.now()
+            closed = [instrument for instrument in self.instruments if instrument.scheduler.poll(now) is not None]
+            if closed:
+                return closed
+            self.clock.sleep(min(instrument.scheduler.sleep_time(now) for instrument in self.instruments))
+
+    def run(self):
+        self.start()
+        self.loop()
+
+    # Function to get ready to trade and process the latest completed bars once
+    def start(self):
+        # Carry on from the state saved before a restart, if any
+        snapshot = self.state.load() if self.state is not None else None
+        if snapshot is not None:
+            start = time.perf_counter()
+            self.restore_state(snapshot)
+            self.stop_loss_monitor.start(resume=True)
+            positions = self.terminal.positions_get() or ()
+            self.reconcile(positions)
+            self.latency.record('warm_start', time.perf_counter() - start)
+        else:
+            self.stop_loss_monitor.start()
+            positions = self.terminal.positions_get() or ()
+
+        # Positions already open are tracked so their stop losses reach the ledger with entry details
+        self.track_positions(positions)
+
+        # Trade on the latest completed bars at startup
+        for instrument in self.instruments:
+            instrument.scheduler.poll(self.clock.now())
+        self.process_timed(self.instruments)
+
+    # Trade on every bar close until stopped
+    def loop(self):
+        while True:
+            self.process_timed(self.wait_for_bar_closes())
+
+    # Function to collect the state a restart needs: each instrument's strategy state, the entry details of open
+    # positions and how far the stop loss monitor has read the order history
+    def snapshot(self):
+        return {
+            'saved_at': time.time(),
+            'instruments': {instrument.state_key(): instrument.snapshot() for instrument in self.instruments},
+            'open_trades': dict(self.open_trades),
+            'stop_loss_cursor': self.stop_loss_monitor.cursor,
+            'stop_loss_seen': list(self.stop_loss_monitor.seen),
+        }
+
+    def restore_state(self, snapshot):
+        restored = [instrument.symbol for instrument in self.instruments
+                    if instrument.state_key() in snapshot['instruments'] and
+                    instrument.restore(snapshot['instruments'][instrument.state_key()])]
+        self.open_trades = dict(snapshot['open_trades'])
+        self.stop_loss_monitor.cursor = snapshot['stop_loss_cursor']
+        self.stop_loss_monitor.seen = OrderedDict.fromkeys(snapshot['stop_loss_seen'], True)
+        print(f"Restored state saved at {time.ctime(snapshot['saved_at'])} for {', '.join(restored) or 'no symbols'}")
+
+    # Function to bring the restored positions up to date: stop losses hit while the bot was down go to the ledger,
+    # and positions closed any other way are reported and forgotten
+    def reconcile(self, positions):
+        for event in self.stop_loss_monitor.drain():
+            print(f"{event.symbol} position {event.position_id} stopped out at {event.price} while stopped")
+            self.record_stop_loss(event)
+
+        open_tickets = {position.ticket for position in positions}
+        for ticket, (symbol, direction, entry_time, entry_price, size) in list(self.open_trades.items()):
+            if ticket not in open_tickets:
+                del self.open_trades[ticket]
+                self.notify("Position Closed", f"{symbol} position {ticket} was closed while the bot was stopped")
+
+    # Function to save the strategy state, a failed write is reported and retried on the next bar
+    def save_state(self):
+        with self.latency.span('state_save'):
+            try:
+                self.state.save(self.snapshot())
+            except OSError as e:
+                print(f"Failed to save strategy state: {e}")
+
+    # Function to process closed bars, timing the whole pass and writing the latency stats when due
+    def process_timed(self, instruments):
+        with self.latency.span('process'):
+            self.process(instruments)
+        if self.state is not None:
+            self.save_state()
+        self.latency.maybe_write()
@@ -0,0 +1,92 @@
+import time
+
+STARTED = time.perf_counter()  # Startup is timed from here, before the imports below
+
+import os
+
+from broker import ReplayFinished, load_terminal, terminal_clock
+from latency import LatencyRecorder
+from live_engine import Instrument, LiveEngine
+from notifications import NotificationDispatcher
+from state_store import StateStore
+from trade_ledger import TradeLedger
+
+# Seconds allowed from launch until the first bars have been processed
+STARTUP_BUDGET = 1.0
+
+# Account and Pushover details come from the environment, so the entry point imports without side effects
+ACCOUNT_ENV = 'MT5_ACCOUNT'
+PASSWORD_ENV = 'MT5_PASSWORD'
+SERVER_ENV = 'MT5_SERVER'
+PUSHOVER_USER_ENV = 'PUSHOVER_USER_KEY'
+PUSHOVER_TOKEN_ENV = 'PUSHOVER_API_TOKEN'
+
+
+# Function to connect to the terminal and log in, returning whether both succeeded
+def connect(terminal, account, password, server):
+    if not terminal.initialize():
+        print(f"initialize() failed, error code = {terminal.last_error()}")
+        return False
+    if not terminal.login(account, password, server):
+        print(f"login() failed, error code = {terminal.last_error()}")
+        terminal.shutdown()
+        return False
+    return True
+
+
+# Function to trade until stopped, reporting how long each part of startup took against the budget
+def main():
+    imported = time.perf_counter()
+    terminal = load_terminal()
+    clock = terminal_clock(terminal)
+    if not connect(terminal, int(os.environ.get(ACCOUNT_ENV, '0')), os.environ.get(PASSWORD_ENV, ''),
+                   os.environ.get(SERVER_ENV, 'MetaQuotes-Demo')):
+        return
+    connected = time.perf_counter()
+
+    # Notifications are queued and sent from a background thread
+    notifier = NotificationDispatcher(os.environ.get(PUSHOVER_USER_ENV, ''), os.environ.get(PUSHOVER_TOKEN_ENV, ''))
+    instruments = [
+        Instrument("XAUUSD", terminal.TIMEFRAME_M5, risk=0.01),
+    ]
+    ledger = TradeLedger()
+    ledger_path = os.path.join('trade_ledger', f"live_{time.strftime('%Y%m%d_%H%M%S')}.parquet")
+    latency = LatencyRecorder(path='latency.json', interval=60.0, tick_to_order=True)
+    engine = LiveEngine(terminal, clock, instruments, notifier.send, ledger=ledger, latency=latency,
+                        state=StateStore('strategy_state.bin'))
+
+    try:
+        engine.start()
+        ready = time.perf_counter()
+        total = ready - STARTED
+        latency.record('startup', total)
+        print(f"Started in {total:.3f}s (imports {imported - STARTED:.3f}s, connect {connected - imported:.3f}s, "
+              f"first bars {ready - connected:.3f}s)")
+        if total > STARTUP_BUDGET:
+            notifier.send('Trading Algorithm', f"Startup took {total:.2f}s, over the {STARTUP_BUDGET:.2f}s budget")
+        notifier.send('Trading Algorithm', 'MA Extrema Algorithm Has Started')
+        engine.loop()
+
+    except KeyboardInterrupt:
+        print("Data collection stopped by user")
+        notifier.send('Trading Algorithm', 'MA Extrema Algorithm Has Been Stopped Manually')
+
+    except ReplayFinished:
+        print("Replay finished")
+
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        notifier.send("Trading Algorithm Error", f"An unexpected error occurred: {e}")
+
+    finally:
+        # Save the trades of this session for comparison with the backtest
+        if len(ledger):
+            os.makedirs('trade_ledger', exist_ok=True)
+            ledger.to_parquet(ledger_path)
+        latency.close()
+        notifier.close()
+        terminal.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import (WARMUP_BARS, calculate_indicator_arrays, extract_trades, generate_signal_array,
+                             simulate_trading_kernel)
+from sweep import load_bars_csv
+
+MODES = ('bootstrap', 'reshuffle', 'spread')
+CHUNK_ELEMENTS = 4_000_000  # Paths times trades resampled at once, about 32 MB per float64 matrix
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+# Function to backtest the strategy and return each closed trade's return on the capital it was sized from, and
+# the part of that return the spread cost (entry and exit half spreads, stop losses fill without one)
+def trade_returns(data, short_window=10, atr_period=14, volatility_threshold=0.001, initial_capital=10000,
+                  leverage=100, risk=0.01):
+    open_prices, high, low, close, spread = (data[column].to_numpy(dtype=np.float64)
+                                             for column in ('open', 'high', 'low', 'close', 'spread'))
+    ma, tr, atr = calculate_indicator_arrays(high, low, close, short_window, atr_period)
+    signal = generate_signal_array(ma, close, atr, volatility_threshold)
+
+    start = WARMUP_BARS
+    open_prices, spread, signal = open_prices[start:], spread[start:], signal[start:]
+    balance, profitable, stop_loss_hit, capital, profitable_signals, total_signals = simulate_trading_kernel(
+        open_prices, spread, signal, ma[start:], low[start:], high[start:], float(initial_capital), float(leverage),
+        float(risk))
+    position_id, entry_index, exit_index, direction, entry_price, exit_price, size, pnl, exit_reason, \
+        bars_in_market = extract_trades(open_prices, spread, signal, stop_loss_hit, balance, float(leverage),
+                                        float(risk))
+
+    # The position still open at the end is not part of the final capital
+    closed = exit_reason != 2
+    entry_index, exit_index, entry_price, pnl, exit_reason = \
+        entry_index[closed], exit_index[closed], entry_price[closed], pnl[closed], exit_reason[closed]
+
+    half_spread = spread / (2 * 100)
+    exit_spread = np.where(exit_reason == 0, half_spread[exit_index], 0.0)
+    returns = pnl / balance[entry_index]
+    spread_costs = risk * leverage * (half_spread[entry_index] + exit_spread) / entry_price
+    return returns, spread_costs
+
+
+# Function to resample one chunk of paths and return each path's final equity, largest drawdown (as a fraction
+# of the peak) and whether its equity ever fell to the ruin level
+def _simulate_chunk(log_returns, returns, spread_costs, mode, paths, seed, initial_capital, ruin_level,
+                    spread_jitter):
+    rng = np.random.default_rng(seed)
+    n = len(log_returns)
+    if mode == 'bootstrap':
+        log_equity = log_returns[rng.integers(0, n, size=(paths, n))]
+    elif mode == 'reshuffle':
+        log_equity = rng.permuted(np.broadcast_to(log_returns, (paths, n)), axis=1)
+    else:
+        # Each trade pays its backtest spread cost scaled by a lognormal factor with a mean of 1, so the jitter
+        # leaves the expected final equity at the backtest's
+        scale = rng.standard_normal(size=(paths, n), dtype=np.float32)
+        scale *= spread_jitter
+        scale -= spread_jitter ** 2 / 2
+        np.exp(scale, out=scale)
+        log_equity = (returns + spread_costs) - spread_costs * scale
+        del scale
+        np.maximum(log_equity, -1.0, out=log_equity)
+        with np.errstate(divide='ignore'):
+            np.log1p(log_equity, out=log_equity)
+
+    # Compound in log space. The running peak starts from the initial capital, so the deepest fall below it is
+    # the lower of the fall below the peak of the path and the fall below zero
+    np.cumsum(log_equity, axis=1, out=log_equity)
+    lowest = np.min(log_equity, axis=1)
+    final = initial_capital * np.exp(log_equity[:, -1])
+    peak = np.maximum.accumulate(log_equity, axis=1)
+    np.subtract(log_equity, peak, out=peak)
+    drawdown = -np.expm1(np.minimum(np.min(peak, axis=1), lowest))
+    ruined = lowest <= np.log(ruin_level)
+    return final, drawdown, ruined
+
+
+# Function to split a number of paths into chunks that keep each resampled matrix within CHUNK_ELEMENTS
+def _chunks(paths, trades):
+    size = max(CHUNK_ELEMENTS // max(trades, 1), 1)
+    return [min(size, paths - start) for start in range(0, paths, size)]
+
+
+# Function to run the Monte Carlo resamples of the trade returns, chunked across a process pool
+# bootstrap draws trades with replacement, reshuffle permutes their order and spread rescales each trade's spread
+# Returns one row per path with its mode, final equity, max drawdown and ruin flag
+def run_monte_carlo(returns, spread_costs, paths=100_000, modes=MODES, initial_capital=10000, ruin_level=0.5,
+                    spread_jitter=0.5, seed=None, max_workers=None):
+    returns = np.ascontiguousarray(returns, dtype=np.float64)
+    spread_costs = np.ascontiguousarray(spread_costs, dtype=np.float64)
+    if len(returns) == 0:
+        raise ValueError("The backtest closed no trades to resample")
+
+    # A loss of the whole capital is ruin with zero equity
+    with np.errstate(divide='ignore'):
+        log_returns = np.log1p(np.maximum(returns, -1.0))
+
+    chunks = _chunks(paths, len(returns))
+    seeds = np.random.SeedSequence(seed).spawn(len(modes) * len(chunks))
+    tasks = [(log_returns, returns, spread_costs, mode, size, seeds[m * len(chunks) + c], initial_capital, ruin_level,
+              spread_jitter) for m, mode in enumerate(modes) for c, size in enumerate(chunks)]
+
+    if max_workers == 1 or len(tasks) == 1:
+        results = [_simulate_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*tasks)))
+
+    return pd.DataFrame({
+        'mode': np.repeat(np.array(modes), paths),
+        'final_equity': np.concatenate([final for final, drawdown, ruined in results]),
+        'max_drawdown': np.concatenate([drawdown for final, drawdown, ruined in results]),
+        'ruined': np.concatenate([ruined for final, drawdown, ruined in results]),
+    })
+
+
+# Function to summarise the path distributions of each mode: quantiles of final equity and max drawdown, the
+# chance of ending below the starting capital and the risk of ruin
+def summarise_paths(results, initial_capital=10000):
+    rows = []
+    for mode, group in results.groupby('mode', sort=False):
+        row = {'mode': mode, 'paths': len(group), 'mean_final_equity': group['final_equity'].mean()}
+        for quantile, value in zip(QUANTILES, np.quantile(group['final_equity'], QUANTILES)):
+            row[f'final_equity_p{round(quantile * 100)}'] = value
+        for quantile, value in zip(QUANTILES, np.quantile(group['max_drawdown'], QUANTILES)):
+            row[f'max_drawdown_p{round(quantile * 100)}'] = value
+        row['probability_of_loss'] = float(np.mean(group['final_equity'] < initial_capital))
+        row['risk_of_ruin'] = float(np.mean(group['ruined']))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Monte Carlo resampling of the MA extrema backtest trades')
+    parser.add_argument('bars', help='CSV of bars with open, high, low, close and spread columns')
+    parser.add_argument('--paths', type=int, default=100_000, help='Paths per mode')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--short-window', type=int, default=10)
+    parser.add_argument('--atr-period', type=int, default=14)
+    parser.add_argument('--volatility-threshold', type=float, default=0.001)
+    parser.add_argument('--initial-capital', type=float, default=10000)
+    parser.add_argument('--leverage', type=float, default=100)
+    parser.add_argument('--risk', type=float, default=0.01)
+    parser.add_argument('--ruin-level', type=float, default=0.5, help='Fraction of the starting capital that is ruin')
+    parser.add_argument('--spread-jitter', type=float, default=0.5, help='Log standard deviation of the spread scale')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='monte_carlo')
+    args = parser.parse_args()
+
+    returns, spread_costs = trade_returns(load_bars_csv(args.bars), args.short_window, args.atr_period,
+                                          args.volatility_threshold, args.initial_capital, args.leverage, args.risk)
+    results = run_monte_carlo(returns, spread_costs, args.paths, args.modes, args.initial_capital, args.ruin_level,
+                              args.spread_jitter, args.seed, args.workers)
+    summary = summarise_paths(results, args.initial_capital)
+
+    summary.to_csv(f"{args.output}_summary.csv", index=False)
+    results.to_parquet(f"{args.output}_paths.parquet", index=False)
+    print(f"{len(returns)} trades, backtest final capital {args.initial_capital * np.prod(1 + returns):.2f}")
+    print(summary.to_string(index=False))
+    print(f"Paths written to {os.path.abspath(args.output)}_paths.parquet")
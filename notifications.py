@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+
+PUSHOVER_URL = "https://api.pushover.net/1/messages.json"
+PUSHOVER_MESSAGE_LIMIT = 1024
+
+
+# Sends Pushover notifications from a background thread so the trading thread never waits on HTTP
+class NotificationDispatcher:
+    def __init__(self, user_key, api_token, url=PUSHOVER_URL, max_queue=100, batch_window=0.5, max_retries=3,
+                 backoff=1.0, timeout=5.0):
+        self.user_key = user_key
+        self.api_token = api_token
+        self.url = url
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.session = None  # Created on the worker thread, so importing requests never delays the caller
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Queue a notification, dropping it if the queue is full
+    def send(self, title, message):
+        try:
+            self.queue.put_nowait((title, message))
+        except queue.Full:
+            self.dropped += 1
+            print(f"Notification queue full, dropped: {title}: {message}")
+
+    # Wait for queued notifications to go out, then stop the worker thread
+    def close(self, timeout=10.0):
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        if self.session is not None:
+            self.session.close()
+
+    def _run(self):
+        import requests
+
+        self.session = requests.Session()
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+
+            # Collect a burst of notifications arriving close together
+            deadline = time.monotonic() + self.batch_window
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=max(remaining, 0)) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            for title, message in coalesce(batch):
+                self._post(title, message)
+
+    def _post(self, title, message):
+        import requests
+
+        data = {
+            "token": self.api_token,
+            "user": self.user_key,
+            "title": title,
+            "message": message[:PUSHOVER_MESSAGE_LIMIT]
+        }
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(self.url, data=data, timeout=self.timeout)
+                if response.status_code == 200:
+                    return True
+                error = response.text
+                # Client errors other than rate limiting will not succeed on retry
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    break
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt)
+
+        self.failed += 1
+        print(f"Failed to send notification '{title}': {error}")
+        return False
+
+
+# Function to merge notifications with the same title into one message, keeping first-seen order
+def coalesce(batch):
+    merged = {}
+    for title, message in batch:
+        merged.setdefault(title, []).append(message)
+    return [(title, "\n".join(messages)) for title, messages in merged.items()]
@@ -0,0 +1,324 @@
+import argparse
+import math
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import WARMUP_BARS, calculate_indicator_arrays, generate_signal_array, max_drawdown, njit
+from bar_store import BAR_DTYPE, BarStore
+
+# Trading settings of one symbol: price digits (the spread is in points of 10 ** -digits), units per lot,
+# the lot step and minimum (0 trades any size, as simulate_trading_kernel does) and the currency profit is in
+SymbolSpec = namedtuple('SymbolSpec', ['digits', 'contract_size', 'volume_step', 'volume_min', 'profit_currency'],
+                        defaults=(2, 1.0, 0.0, 0.0, 'USD'))
+
+# Price digits of the symbols traded so far, other symbols default to 5 (3 for yen pairs)
+SYMBOL_DIGITS = {'XAUUSD': 2, 'XAGUSD': 3}
+
+PortfolioResult = namedtuple('PortfolioResult', ['symbols', 'times', 'equity', 'margin', 'offsets', 'symbol_times',
+                                                 'symbol_equity', 'capital', 'total_signals', 'profitable_signals',
+                                                 'stop_losses', 'skipped'])
+
+
+# Function to get the spec of a symbol from the terminal, or from its name alone without one (the profit
+# currency of a six letter symbol is its quote currency)
+def symbol_spec(symbol, terminal=None):
+    profit_currency = symbol[3:] if len(symbol) == 6 else 'USD'
+    if terminal is not None:
+        info = terminal.symbol_info(symbol)
+        if info is not None:
+            return SymbolSpec(info.digits, info.trade_contract_size, info.volume_step, info.volume_min,
+                              getattr(info, 'currency_profit', profit_currency))
+    return SymbolSpec(SYMBOL_DIGITS.get(symbol, 3 if symbol.endswith('JPY') else 5), profit_currency=profit_currency)
+
+
+# Function to count the distinct bar times across every symbol
+@njit(cache=True)
+def _merged_length(times, offsets):
+    symbols = len(offsets) - 1
+    cursor = offsets[:-1].copy()
+    count = 0
+    while True:
+        now = np.iinfo(np.int64).max
+        for s in range(symbols):
+            if cursor[s] < offsets[s + 1] and times[cursor[s]] < now:
+                now = times[cursor[s]]
+        if now == np.iinfo(np.int64).max:
+            return count
+        for s in range(symbols):
+            if cursor[s] < offsets[s + 1] and times[cursor[s]] == now:
+                cursor[s] += 1
+        count += 1
+
+
+# Function to run the simulation of every symbol against one account, stepping through the merged bar times
+# Each symbol trades as in simulate_trading_kernel, sized from the shared balance, and a position only opens if
+# the free margin covers it and fewer than max_open positions are open
+@njit(cache=True)
+def portfolio_kernel(times, open_prices, high, low, spread, signal, ma, offsets, spread_divisor, lot_units,
+                     min_units, initial_capital, leverage, risk, max_open, merged):
+    symbols = len(offsets) - 1
+    cursor = offsets[:-1].copy()
+    position = np.zeros(symbols)  # Units, positive for long, negative for short
+    open_price = np.zeros(symbols)
+    has_stop = np.zeros(symbols, dtype=np.bool_)
+    stop_loss = np.zeros(symbols)
+    unrealized = np.zeros(symbols)  # Profit of each open position at its last open price
+    used_margin = np.zeros(symbols)
+    realized = np.zeros(symbols)
+    profit_loss = np.zeros(symbols)
+    active = np.zeros(symbols, dtype=np.bool_)
+
+    merged_times = np.empty(merged, np.int64)
+    equity = np.empty(merged)
+    margin = np.empty(merged)
+    symbol_equity = np.empty(len(times))
+    total_signals = np.zeros(symbols, np.int64)
+    profitable_signals = np.zeros(symbols, np.int64)
+    stop_losses = np.zeros(symbols, np.int64)
+    skipped = np.zeros(symbols, np.int64)
+    capital = initial_capital
+    open_count = 0
+
+    for k in range(merged):
+        now = np.iinfo(np.int64).max
+        for s in range(symbols):
+            if cursor[s] < offsets[s + 1] and times[cursor[s]] < now:
+                now = times[cursor[s]]
+        merged_times[k] = now
+
+        # Mark the positions of the symbols with a bar at this time, then record the account before trading
+        for s in range(symbols):
+            active[s] = cursor[s] < offsets[s + 1] and times[cursor[s]] == now
+            if not active[s]:
+                continue
+            j = cursor[s]
+            half_spread = spread[j] / spread_divisor[s]
+            if position[s] > 0:
+                profit_loss[s] = position[s] * (open_prices[j] - half_spread - open_price[s])
+            elif position[s] < 0:
+                profit_loss[s] = position[s] * (open_prices[j] + half_spread - open_price[s])
+            else:
+                profit_loss[s] = 0.0
+            unrealized[s] = profit_loss[s]
+            symbol_equity[j] = realized[s] + profit_loss[s]
+        equity[k] = capital + np.sum(unrealized)
+        margin[k] = np.sum(used_margin)
+
+        for s in range(symbols):
+            if not active[s]:
+                continue
+            j = cursor[s]
+            i = j - offsets[s]
+            half_spread = spread[j] / spread_divisor[s]
+            buy_price = open_prices[j] + half_spread
+            sell_price = open_prices[j] - half_spread
+
+            if signal[j] != 0:
+                direction = 1 if signal[j] == 1 else -1
+                if position[s] * direction < 0:
+                    capital += profit_loss[s]
+                    realized[s] += profit_loss[s]
+                    if profit_loss[s] > 0:
+                        profitable_signals[s] += 1
+                    position[s] = 0.0
+                    unrealized[s] = 0.0
+                    used_margin[s] = 0.0
+                    open_count -= 1
+                if position[s] == 0:
+                    price = buy_price if direction == 1 else sell_price
+                    units = (risk * capital * leverage) / price
+                    if lot_units[s] > 0:
+                        units = math.floor(units / lot_units[s]) * lot_units[s]
+                    required = units * price / leverage
+                    free_margin = capital + np.sum(unrealized) - np.sum(used_margin)
+                    if units <= 0 or units < min_units[s] or required > free_margin or \
+                            (max_open > 0 and open_count >= max_open):
+                        skipped[s] += 1
+                    else:
+                        open_price[s] = price
+                        position[s] = units * direction
+                        used_margin[s] = required
+                        # A new position is worth the spread less than it cost until the next bar marks it
+                        unrealized[s] = position[s] * ((sell_price if direction == 1 else buy_price) - price)
+                        open_count += 1
+                total_signals[s] += 1
+
+            # Trail the stop only while the position was in profit at the open, as simulate_trading_kernel does
+            if profit_loss[s] > 0 and i > 1:
+                new_stop_loss = ma[j - 2]
+                if position[s] > 0:
+                    if not has_stop[s] or new_stop_loss > stop_loss[s]:
+                        stop_loss[s] = new_stop_loss
+                        has_stop[s] = True
+                elif position[s] < 0:
+                    if not has_stop[s] or new_stop_loss < stop_loss[s]:
+                        stop_loss[s] = new_stop_loss
+                        has_stop[s] = True
+
+            if has_stop[s]:
+                if (position[s] > 0 and low[j] < stop_loss[s]) or (position[s] < 0 and high[j] > stop_loss[s]):
+                    closed = position[s] * (stop_loss[s] - open_price[s])
+                    capital += closed
+                    realized[s] += closed
+                    if closed > 0:
+                        profitable_signals[s] += 1
+                    stop_losses[s] += 1
+                    position[s] = 0.0
+                    has_stop[s] = False
+                    unrealized[s] = 0.0
+                    used_margin[s] = 0.0
+                    open_count -= 1
+
+            cursor[s] += 1
+
+    return (merged_times, equity, margin, symbol_equity, capital, total_signals, profitable_signals, stop_losses,
+            skipped)
+
+
+# Function to load bars given as a structured array, a DataFrame or a .bars file path
+def _load_bars(bars):
+    if isinstance(bars, (str, os.PathLike)):
+        count = os.path.getsize(bars) // BAR_DTYPE.itemsize
+        return np.memmap(bars, dtype=BAR_DTYPE, mode='r', shape=(count,)) if count else \
+            np.empty(0, dtype=BAR_DTYPE)
+    if isinstance(bars, pd.DataFrame):
+        frame = bars.reset_index() if 'time' not in bars.columns else bars
+        return {name: frame[name].to_numpy() if name != 'time' else
+                frame['time'].to_numpy().astype('datetime64[s]').astype(np.int64)
+                for name in ('time', 'open', 'high', 'low', 'close', 'spread')}
+    return bars
+
+
+# Function to calculate one symbol's signals and write the columns the kernel reads, after the warm-up bars, into
+# its slice of the flat arrays
+def _fill_symbol(columns, start, end, bars, short_window, atr_period, volatility_threshold):
+    high = np.ascontiguousarray(bars['high'], dtype=np.float64)
+    low = np.ascontiguousarray(bars['low'], dtype=np.float64)
+    close = np.ascontiguousarray(bars['close'], dtype=np.float64)
+    ma, tr, atr = calculate_indicator_arrays(high, low, close, short_window, atr_period)
+    signal = generate_signal_array(ma, close, atr, volatility_threshold)
+
+    warmup = WARMUP_BARS
+    columns['time'][start:end] = bars['time'][warmup:]
+    columns['open'][start:end] = bars['open'][warmup:]
+    columns['high'][start:end] = high[warmup:]
+    columns['low'][start:end] = low[warmup:]
+    columns['spread'][start:end] = bars['spread'][warmup:]
+    columns['signal'][start:end] = np.where(np.isnan(signal[warmup:]), 0, signal[warmup:])
+    columns['ma'][start:end] = ma[warmup:]
+
+
+# Function to backtest the strategy on several symbols sharing one account
+# sources maps each symbol to its bars (structured array, DataFrame or .bars path), specs maps symbols to a
+# SymbolSpec and max_open caps the positions open at once across the portfolio (0 for no cap)
+# Profit, margin and sizes are not converted between currencies, so every symbol must take profit in the account
+# currency
+def backtest_portfolio(sources, specs=None, short_window=10, atr_period=14, volatility_threshold=0.001,
+                       initial_capital=10000, leverage=100, risk=0.01, max_open=0, account_currency='USD'):
+    specs = specs or {}
+    symbols = list(sources)
+    symbol_specs = [specs.get(symbol) or symbol_spec(symbol) for symbol in symbols]
+    converted = [symbol for symbol, spec in zip(symbols, symbol_specs) if spec.profit_currency != account_currency]
+    if converted:
+        raise ValueError(f"Profit of {', '.join(converted)} is not in the account currency {account_currency}")
+
+    # One flat array per column with the symbols back to back, filled in place so no symbol is held twice
+    lengths = [max(len(_load_bars(sources[symbol])['time']) - WARMUP_BARS, 0) for symbol in symbols]
+    offsets = np.zeros(len(symbols) + 1, np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    total = int(offsets[-1])
+    columns = {'time': np.empty(total, np.int64), 'open': np.empty(total), 'high': np.empty(total),
+               'low': np.empty(total), 'spread': np.empty(total, np.int32), 'signal': np.empty(total, np.int8),
+               'ma': np.empty(total)}
+    for s, symbol in enumerate(symbols):
+        if lengths[s]:
+            _fill_symbol(columns, offsets[s], offsets[s + 1], _load_bars(sources[symbol]), short_window, atr_period,
+                         volatility_threshold)
+
+    spread_divisor = np.array([2.0 * 10 ** spec.digits for spec in symbol_specs])
+    lot_units = np.array([spec.contract_size * spec.volume_step for spec in symbol_specs], dtype=np.float64)
+    min_units = np.array([spec.contract_size * spec.volume_min for spec in symbol_specs], dtype=np.float64)
+
+    merged = _merged_length(columns['time'], offsets)
+    times, equity, margin, symbol_equity, capital, total_signals, profitable_signals, stop_losses, skipped = \
+        portfolio_kernel(columns['time'], columns['open'], columns['high'], columns['low'], columns['spread'],
+                         columns['signal'], columns['ma'], offsets, spread_divisor, lot_units, min_units,
+                         float(initial_capital), float(leverage), float(risk), int(max_open), merged)
+
+    return PortfolioResult(symbols, times, equity, margin, offsets, columns['time'], symbol_equity, capital,
+                           total_signals, profitable_signals, stop_losses, skipped)
+
+
+# Function to get one symbol's profit curve (realized plus open profit at each of its bars) from a result
+def symbol_equity_curve(result, symbol):
+    s = result.symbols.index(symbol)
+    start, end = result.offsets[s], result.offsets[s + 1]
+    return pd.Series(result.symbol_equity[start:end], index=pd.to_datetime(result.symbol_times[start:end], unit='s'),
+                     name=symbol)
+
+
+# Function to summarise each symbol's contribution and the account as a whole
+def portfolio_summary(result, initial_capital=10000):
+    rows = []
+    for s, symbol in enumerate(result.symbols):
+        start, end = result.offsets[s], result.offsets[s + 1]
+        profit = result.symbol_equity[start:end]
+        total = int(result.total_signals[s])
+        rows.append({
+            'symbol': symbol,
+            'bars': int(end - start),
+            'profit': float(profit[-1]) if len(profit) else 0.0,
+            'max_drawdown': float(np.max(np.maximum.accumulate(profit) - profit)) if len(profit) else 0.0,
+            'total_signals': total,
+            'profitable_signals': int(result.profitable_signals[s]),
+            'hit_rate': result.profitable_signals[s] / total if total else 0.0,
+            'stop_losses': int(result.stop_losses[s]),
+            'skipped': int(result.skipped[s]),
+        })
+    summary = pd.DataFrame(rows)
+    account = {
+        'final_capital': float(result.capital),
+        'return': float(result.capital) / initial_capital - 1,
+        'max_drawdown': max_drawdown(result.equity),
+        'peak_margin': float(np.max(result.margin)) if len(result.margin) else 0.0,
+        'bars': int(len(result.times)),
+    }
+    return summary, account
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtest the MA extrema strategy on several symbols sharing one '
+                                                 'account, from the bars in the local bar store')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--timeframe', type=int, default=5, help='MT5 timeframe constant, 5 for M5')
+    parser.add_argument('--root', default='bar_data')
+    parser.add_argument('--initial-capital', type=float, default=10000)
+    parser.add_argument('--leverage', type=float, default=100)
+    parser.add_argument('--risk', type=float, default=0.01)
+    parser.add_argument('--volatility-threshold', type=float, default=0.001)
+    parser.add_argument('--max-open', type=int, default=0, help='Positions open at once across symbols, 0 for any')
+    parser.add_argument('--currency', default='USD', help='Account currency, every symbol must take profit in it')
+    parser.add_argument('--output', default='portfolio')
+    args = parser.parse_args()
+
+    store = BarStore(args.root)
+    result = backtest_portfolio({symbol: store.path(symbol, args.timeframe) for symbol in args.symbols},
+                                volatility_threshold=args.volatility_threshold,
+                                initial_capital=args.initial_capital, leverage=args.leverage, risk=args.risk,
+                                max_open=args.max_open, account_currency=args.currency)
+    summary, account = portfolio_summary(result, args.initial_capital)
+
+    summary.to_csv(f"{args.output}_symbols.csv", index=False)
+    pd.DataFrame({'equity': result.equity, 'margin': result.margin},
+                 index=pd.to_datetime(result.times, unit='s')).to_csv(f"{args.output}_equity.csv", index_label='time')
+    print(summary.to_string(index=False))
+    for name, value in account.items():
+        print(f"{name}: {value}")
+    try:
+        import resource  # Unix only, the MT5 terminal runs on Windows
+        print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    except ImportError:
+        pass
@@ -0,0 +1,65 @@
+import numpy as np
+
+
+# Function to round stop levels down to a number of digits
+def round_down(value, digits=3):
+    scale = 10 ** digits
+    return np.floor(value * scale) / float(scale)
+
+
+# Function to round stop levels up to a number of digits
+def round_up(value, digits=3):
+    scale = 10 ** digits
+    return np.ceil(value * scale) / float(scale)
+
+
+# Open positions as columns, filled from one positions_get a cycle and kept up to date from trade results
+class PositionBook:
+    def __init__(self, buy_type=0):
+        self.buy_type = buy_type
+        self.refresh(())
+
+    # Replace the book with the positions the terminal returned
+    def refresh(self, positions):
+        self.positions = tuple(positions)
+        self.tickets = np.array([position.ticket for position in self.positions], dtype=np.int64)
+        self.symbols = np.array([position.symbol for position in self.positions], dtype=object)
+        self.magics = np.array([position.magic for position in self.positions], dtype=np.int64)
+        self.is_long = np.array([position.type == self.buy_type for position in self.positions], dtype=bool)
+        self.volumes = np.array([position.volume for position in self.positions], dtype=np.float64)
+        self.sl = np.array([position.sl for position in self.positions], dtype=np.float64)
+        self.price = np.array([position.price_current for position in self.positions], dtype=np.float64)
+        self.profit = np.array([position.profit for position in self.positions], dtype=np.float64)
+        self.open = np.ones(len(self.positions), dtype=bool)
+
+    # Record volume closed from a position, dropping it once fully closed
+    def close(self, ticket, volume):
+        index = np.flatnonzero(self.tickets == ticket)
+        if len(index):
+            self.volumes[index] = np.round(self.volumes[index] - volume, 8)
+            self.open[index] &= self.volumes[index] > 0
+
+    # Record a stop loss the broker accepted
+    def set_stop(self, ticket, sl):
+        self.sl[self.tickets == ticket] = sl
+
+    # Function to find the profitable positions of an instrument whose stop should trail to an MA level, rounded
+    # away from the price to the stop digits. Stops only move in the position's favour and by at least min_step,
+    # and stay at least the broker's stop distance (and one point) from the price. Returns the tickets and their
+    # new stops
+    def trailing_stops(self, symbol, magic, level, digits, min_step=0.0, stop_distance=0.0, point=0.0):
+        candidates = self.open & (self.symbols == symbol) & (self.magics == magic) & (self.profit > 0)
+        if not candidates.any():
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        is_long = self.is_long[candidates]
+        sl = self.sl[candidates]
+        price = self.price[candidates]  # The bid for long positions, the ask for short ones
+        gap = max(stop_distance, point)
+        target = np.where(is_long, np.minimum(round_down(level, digits), round_down(price - gap, digits)),
+                          np.maximum(round_up(level, digits), round_up(price + gap, digits)))
+
+        # A stop at the quote would be rejected or fill at once
+        gain = np.where(is_long, target - sl, sl - target)
+        move = ((sl == 0) | ((gain > 0) & (gain >= min_step))) & np.where(is_long, target < price, target > price)
+        return self.tickets[candidates][move], target[move]
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import backtest_frame, max_drawdown
+from trade_ledger import backtest_ledger
+
+
+# Function to calculate the annualised Sharpe ratio from the daily closing balance
+def sharpe_ratio(balance, periods_per_year=252):
+    daily = balance.resample('1D').last().dropna()
+    returns = daily.pct_change().dropna()
+    if len(returns) < 2 or returns.std() == 0:
+        return 0.0
+    return float(returns.mean() / returns.std() * np.sqrt(periods_per_year))
+
+
+# Function to sum the realised P&L of the trades by the UTC hour they closed
+def hourly_pnl(trades):
+    closed = trades[trades['exit_reason'] != 'open']
+    grouped = closed.groupby(closed['exit_time'].dt.hour)['pnl']
+    table = pd.DataFrame({'trades': grouped.size(), 'pnl': grouped.sum(),
+                          'win_rate': grouped.apply(lambda pnl: float((pnl > 0).mean()))})
+    return table.reindex(range(24), fill_value=0).rename_axis('hour')
+
+
+# Function to calculate the summary metrics of a backtested DataFrame
+def performance_metrics(data, trades, bars_in_market, initial_capital=10000):
+    balance = data['Balance']
+    closed = trades[trades['exit_reason'] != 'open']
+    total_signals = int((data['Signal'] != 0).sum())
+    profitable_signals = int((data['Profitable'] == 1).sum())
+    return {
+        'start': str(data.index[0]),
+        'end': str(data.index[-1]),
+        'bars': len(data),
+        'initial_capital': float(initial_capital),
+        'final_capital': float(initial_capital + closed['pnl'].sum()),
+        'final_balance': float(balance.iloc[-1]),
+        'total_return': float(balance.iloc[-1] / initial_capital - 1),
+        'sharpe': sharpe_ratio(balance),
+        'max_drawdown': max_drawdown(balance.to_numpy()),
+        'exposure': bars_in_market / len(data),
+        'total_signals': total_signals,
+        'profitable_signals': profitable_signals,
+        'hit_rate': profitable_signals / total_signals if total_signals else 0.0,
+        'trades': len(closed),
+        'stop_loss_exits': int((closed['exit_reason'] == 'stop_loss').sum()),
+        'win_rate': float((closed['pnl'] > 0).mean()) if len(closed) else 0.0,
+        'average_pnl': float(closed['pnl'].mean()) if len(closed) else 0.0,
+    }
+
+
+# Function to reduce a series to the min and max of each pixel-wide bucket, so spikes survive downsampling
+def minmax_downsample(times, values, buckets):
+    n = len(values)
+    if n <= 2 * buckets:
+        return times, values, values
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)[:-1]
+    return times[edges], np.fmin.reduceat(values, edges), np.fmax.reduceat(values, edges)
+
+
+# Function to keep at most one marker per pixel-wide bucket
+def thin_markers(positions, n, buckets):
+    if len(positions) <= buckets:
+        return positions
+    _, first = np.unique(positions * buckets // n, return_index=True)
+    return positions[first]
+
+
+# Function to load pyplot when a chart is first drawn, so reports without charts never import matplotlib
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')  # Render to files, no display needed
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Function to plot the balance curve to a file
+def plot_equity(data, path, width=1600, height=500, dpi=100):
+    plt = _pyplot()
+    times, low, high = minmax_downsample(data.index.to_numpy(), data['Balance'].to_numpy(dtype=np.float64), width)
+    fig, ax = plt.subplots(figsize=(width / dpi, height / dpi), dpi=dpi)
+    ax.fill_between(times, low, high, step='post', linewidth=0.8, color='tab:blue')
+    ax.set_title('Balance Over Time')
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Balance')
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+# Function to plot the price range, moving average, signals and stop losses to a file
+def plot_signals(data, path, width=1600, height=700, dpi=100):
+    plt = _pyplot()
+    index = data.index.to_numpy()
+    times, low, _ = minmax_downsample(index, data['low'].to_numpy(dtype=np.float64), width)
+    _, _, high = minmax_downsample(index, data['high'].to_numpy(dtype=np.float64), width)
+    ma_times, ma_low, ma_high = minmax_downsample(index, data['MA_S'].to_numpy(dtype=np.float64), width)
+
+    fig, ax = plt.subplots(figsize=(width / dpi, height / dpi), dpi=dpi)
+    ax.fill_between(times, low, high, step='post', color='grey', alpha=0.5, linewidth=0, label='High/Low')
+    ax.fill_between(ma_times, ma_low, ma_high, step='post', color='tab:blue', linewidth=0.8, label='MA_S')
+
+    n = len(data)
+    open_prices = data['open'].to_numpy(dtype=np.float64)
+    signal = data['Signal'].to_numpy()
+    profitable = data['Profitable'].to_numpy()
+    stop_loss = data['StopLoss'].to_numpy(dtype=np.float64)
+    markers = [
+        (np.flatnonzero(signal > 0), open_prices, dict(marker='^', color='g', label='Buy')),
+        (np.flatnonzero(signal < 0), open_prices, dict(marker='v', color='r', label='Sell')),
+        (np.flatnonzero(profitable == 1), open_prices,
+         dict(marker='o', facecolors='none', edgecolors='black', label='Profitable')),
+        (np.flatnonzero(~np.isnan(stop_loss)), stop_loss, dict(marker='x', color='orange', label='Stop Loss')),
+    ]
+    for positions, prices, style in markers:
+        positions = thin_markers(positions, n, width)
+        if len(positions):
+            ax.scatter(index[positions], prices[positions], s=30, **style)
+
+    ax.set_title('Price with Moving Average and Signals')
+    ax.legend(loc='upper left')
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+# Function to write the metrics, trade ledger, hourly P&L and charts of a backtested DataFrame to a directory
+def write_report(data, output_dir, initial_capital=10000, leverage=100, risk=0.01, charts=True, symbol=''):
+    os.makedirs(output_dir, exist_ok=True)
+    ledger, bars_in_market = backtest_ledger(data, symbol, leverage, risk)
+    trades = ledger.frame()
+    metrics = performance_metrics(data, trades, bars_in_market, initial_capital)
+
+    with open(os.path.join(output_dir, 'metrics.json'), 'w') as file:
+        json.dump(metrics, file, indent=2)
+    trades.to_csv(os.path.join(output_dir, 'trades.csv'), index=False)
+    ledger.to_parquet(os.path.join(output_dir, 'trades.parquet'))  # Same schema as the live bot's ledger
+    hourly_pnl(trades).to_csv(os.path.join(output_dir, 'hourly_pnl.csv'))
+    data['Balance'].to_csv(os.path.join(output_dir, 'equity.csv'))
+
+    if charts:
+        plot_equity(data, os.path.join(output_dir, 'equity.png'))
+        plot_signals(data, os.path.join(output_dir, 'signals.png'))
+
+    return metrics
+
+
+if __name__ == "__main__":
+    from sweep import load_bars_csv
+
+    parser = argparse.ArgumentParser(description='Backtest a bar file and write a headless performance report')
+    parser.add_argument('bars', help='CSV of bars with time, open, high, low, close and spread columns')
+    parser.add_argument('--output', default='reports')
+    parser.add_argument('--short-window', type=int, default=10)
+    parser.add_argument('--atr-period', type=int, default=14)
+    parser.add_argument('--volatility-threshold', type=float, default=0.001)
+    parser.add_argument('--initial-capital', type=float, default=10000)
+    parser.add_argument('--leverage', type=float, default=100)
+    parser.add_argument('--risk', type=float, default=0.01)
+    parser.add_argument('--symbol', default='')
+    parser.add_argument('--no-charts', action='store_true')
+    args = parser.parse_args()
+
+    bars = load_bars_csv(args.bars).set_index('time')
+    bars = backtest_frame(bars, args.short_window, args.atr_period, args.volatility_threshold,
+                          args.initial_capital, args.leverage, args.risk)
+    print(json.dumps(write_report(bars, args.output, args.initial_capital, args.leverage, args.risk,
+                                  not args.no_charts, args.symbol), indent=2))
@@ -0,0 +1,61 @@
+import os
+import pickle
+import struct
+import zlib
+
+SNAPSHOT_MAGIC = b'FXAS'
+SNAPSHOT_VERSION = 1
+
+# Magic, format version, CRC32 and length of the pickled payload that follows
+HEADER = struct.Struct('<4sHII')
+
+
+# Saves the live strategy state after every bar so a restart can carry on from it
+class StateStore:
+    def __init__(self, path='strategy_state.bin'):
+        self.path = path
+
+    # Write a snapshot to a temporary file, flush it to disk and swap it in, so a crash at any point leaves
+    # either the previous snapshot or this one
+    def save(self, snapshot):
+        payload = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, zlib.crc32(payload), len(payload))
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(header + payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+        # The rename itself is only durable once the directory is flushed (not possible on Windows)
+        if hasattr(os, 'O_DIRECTORY'):
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    # Function to read the last snapshot, returning None if there is none or it cannot be trusted
+    def load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < HEADER.size:
+            print(f"Ignoring truncated state file {self.path}")
+            return None
+        magic, version, checksum, length = HEADER.unpack_from(data)
+        payload = data[HEADER.size:]
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            print(f"Ignoring state file {self.path} written by another version")
+            return None
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            print(f"Ignoring corrupt state file {self.path}")
+            return None
+        try:
+            return pickle.loads(payload)
+        except (pickle.UnpicklingError, AttributeError, ImportError, EOFError) as e:
+            print(f"Ignoring unreadable state file {self.path}: {e}")
+            return None
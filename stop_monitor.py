@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+StopLossEvent = namedtuple('StopLossEvent', ['ticket', 'position_id', 'type', 'symbol', 'volume', 'price', 'time'])
+
+
+# Watches order history for stop-loss fills, querying only the orders newer than the last one seen
+class StopLossMonitor:
+    def __init__(self, terminal, symbols, poll_interval=1.0, overlap=60, max_seen=1000, on_stop_loss=None):
+        self.terminal = terminal
+        self.symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        self.poll_interval = poll_interval
+        self.overlap = overlap  # Seconds re-queried before the cursor, de-duplicated by ticket
+        self.max_seen = max_seen
+        self.on_stop_loss = on_stop_loss
+        self.events = queue.Queue()
+        self.cursor = None  # Server time of the newest order seen
+        self.seen = OrderedDict()  # Recently seen tickets, oldest first
+        self.lock = threading.Lock()  # poll runs on the monitor thread and from the trading loop
+        self.thread = None
+
+    # Server time from the newest tick of any of the symbols, so one closed market does not stall the cursor
+    def _server_time(self):
+        times = [tick.time for tick in map(self.terminal.symbol_info_tick, self.symbols) if tick is not None]
+        return max(times) if times else self.cursor
+
+    # Start polling from a background thread. resume=True carries on from a restored cursor, reporting the stop
+    # losses since then, otherwise only stop losses from now on are reported
+    def start(self, resume=False):
+        server_time = self._server_time()
+        if resume and self.cursor is not None and (server_time is None or self.cursor <= server_time):
+            self.poll()
+        else:
+            # Orders already in the overlap window are marked as seen
+            self.cursor = server_time
+            self.seen.clear()
+            self.poll(emit=False)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Stop loss monitor error: {e}")
+            time.sleep(self.poll_interval)
+
+    # Query the history since the cursor and queue an event for each new stop-loss order
+    def poll(self, emit=True):
+        with self.lock:
+            return self._poll(emit)
+
+    def _poll(self, emit):
+        server_time = self._server_time()
+        if self.cursor is None:
+            self.cursor = server_time
+        if self.cursor is None:
+            return 0
+
+        # The upper bound is a day ahead so a server clock ahead of ours never hides orders
+        orders = self.terminal.history_orders_get(self.cursor - self.overlap, max(server_time, self.cursor) + 86400)
+        if orders is None:
+            return 0
+
+        new_events = 0
+        for order in sorted(orders, key=lambda order: (order.time_setup, order.ticket)):
+            if order.ticket in self.seen:
+                continue
+            self.seen[order.ticket] = True
+            if len(self.seen) > self.max_seen:
+                self.seen.popitem(last=False)
+            self.cursor = max(self.cursor, order.time_setup)
+
+            if emit and order.reason == self.terminal.ORDER_REASON_SL:
+                event = StopLossEvent(order.ticket, order.position_id, order.type, order.symbol,
+                                      order.volume_initial, order.price_current, order.time_setup)
+                self.events.put(event)
+                new_events += 1
+                if self.on_stop_loss is not None:
+                    self.on_stop_loss(event)
+        return new_events
+
+    # Take every queued stop-loss event without blocking
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
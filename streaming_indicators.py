@@ -0,0 +1,161 @@
+import math
+from collections import deque
+
+import numpy as np
+
+
+# Rolling mean updated one value at a time, using the same Kahan summation as pandas rolling().mean()
+class RollingMean:
+    __slots__ = ('window', 'min_periods', 'values', 'nobs', 'sum_x', 'neg_ct', 'compensation_add',
+                 'compensation_remove', 'num_consecutive_same_value', 'prev_value')
+
+    def __init__(self, window, min_periods=None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.values = deque()
+        self.nobs = 0
+        self.sum_x = 0.0
+        self.neg_ct = 0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.num_consecutive_same_value = 0
+        self.prev_value = None
+
+    def update(self, value):
+        if self.prev_value is None:
+            self.prev_value = value
+
+        # Remove the value leaving the window before adding the new one
+        if len(self.values) == self.window:
+            old = self.values.popleft()
+            if old == old:
+                self.nobs -= 1
+                y = -old - self.compensation_remove
+                t = self.sum_x + y
+                self.compensation_remove = t - self.sum_x - y
+                self.sum_x = t
+                if math.copysign(1.0, old) < 0:
+                    self.neg_ct -= 1
+
+        self.values.append(value)
+        if value == value:
+            self.nobs += 1
+            y = value - self.compensation_add
+            t = self.sum_x + y
+            self.compensation_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct += 1
+            if value == self.prev_value:
+                self.num_consecutive_same_value += 1
+            else:
+                self.num_consecutive_same_value = 1
+            self.prev_value = value
+
+        return self.mean()
+
+    def mean(self):
+        if self.nobs < self.min_periods or self.nobs == 0:
+            return math.nan
+        result = self.sum_x / self.nobs
+        if self.num_consecutive_same_value >= self.nobs:
+            result = self.prev_value
+        elif self.neg_ct == 0 and result < 0:
+            result = 0.0
+        elif self.neg_ct == self.nobs and result > 0:
+            result = 0.0
+        return result
+
+
+# MA extrema strategy state, updated once per completed bar in constant time
+class MAExtremaStream:
+    __slots__ = ('ma_mean', 'atr_mean', 'volatility_threshold', 'ma', 'previous_ma', 'second_previous_ma',
+                 'previous_close', 'atr', 'previous_atr', 'last_extrema', 'scnd_last_extrema', 'hold1', 'hold2',
+                 'bars')
+
+    # volatility_threshold=None skips the ATR filter, as the live bot does
+    def __init__(self, short_window=10, volatility_threshold=None, atr_period=14):
+        self.ma_mean = RollingMean(short_window, min_periods=1)
+        self.atr_mean = RollingMean(atr_period) if volatility_threshold is not None else None
+        self.volatility_threshold = volatility_threshold
+        self.ma = math.nan
+        self.previous_ma = math.nan
+        self.second_previous_ma = math.nan
+        self.previous_close = None
+        self.atr = math.nan
+        self.previous_atr = math.nan
+        self.last_extrema = None
+        self.scnd_last_extrema = None
+        self.hold1 = None
+        self.hold2 = None
+        self.bars = 0
+
+    # Update the moving averages without looking for extrema or signals
+    def prime(self, high, low, close):
+        self.second_previous_ma = self.previous_ma
+        self.previous_ma = self.ma
+        self.ma = self.ma_mean.update(close)
+
+        if self.atr_mean is not None:
+            if self.previous_close is None:
+                true_range = math.nan
+            else:
+                true_range = max(high - low, max(abs(high - self.previous_close), abs(low - self.previous_close)))
+            self.previous_atr = self.atr
+            self.atr = self.atr_mean.update(true_range)
+
+        self.previous_close = close
+        self.bars += 1
+        return self.ma
+
+    # Add a completed bar and return the signal to trade at the open of the next bar
+    def update(self, high, low, close):
+        extrema_close = self.previous_close
+        self.prime(high, low, close)
+
+        signal = 0
+        if self.bars >= 3:
+            # Check if the previous MA value is a local minimum or maximum
+            if self.previous_ma < self.second_previous_ma and self.previous_ma < self.ma:
+                signal = 1
+            elif self.previous_ma > self.second_previous_ma and self.previous_ma > self.ma:
+                signal = -1
+
+            if signal != 0:
+                self.scnd_last_extrema = self.last_extrema
+                self.last_extrema = self.previous_ma
+
+                if self.atr_mean is not None and not self.previous_atr < self.volatility_threshold * extrema_close:
+                    signal = 0
+                elif self.scnd_last_extrema is not None:
+                    distance_extrema = abs(self.last_extrema - self.scnd_last_extrema)
+                    if abs(close - self.ma) >= distance_extrema:
+                        signal = 0
+
+        self.hold2 = self.hold1
+        self.hold1 = signal
+        return signal
+
+    # Add a batch of completed bars in order and return the signal of the last one
+    def update_many(self, high, low, close):
+        signal = 0
+        update = self.update
+        for bar_high, bar_low, bar_close in zip(np.asarray(high, dtype=np.float64).tolist(),
+                                                np.asarray(low, dtype=np.float64).tolist(),
+                                                np.asarray(close, dtype=np.float64).tolist()):
+            signal = update(bar_high, bar_low, bar_close)
+        return signal
+
+
+# Function to run the streaming state over price arrays, aligned like generate_signal_array
+def stream_signals(high, low, close, short_window=10, atr_period=14, volatility_threshold=0.001):
+    stream = MAExtremaStream(short_window, volatility_threshold, atr_period)
+    n = len(close)
+    signal = np.full(n, np.nan)
+    if n > 2:
+        signal[2:] = 0
+    for i, (bar_high, bar_low, bar_close) in enumerate(zip(high.tolist(), low.tolist(), close.tolist())):
+        bar_signal = stream.update(bar_high, bar_low, bar_close)
+        if i + 1 < n and i >= 1:
+            signal[i + 1] = bar_signal
+    return signal
@@ -0,0 +1,141 @@
+import argparse
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import (WARMUP_BARS, calculate_indicator_arrays, generate_signal_array, max_drawdown,
+                             simulate_trading_kernel)
+
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'spread')
+
+# Search space around the values hardcoded in the backtester
+DEFAULT_GRID = {
+    'short_window': [5, 8, 10, 12, 15, 20],
+    'atr_period': [7, 10, 14, 21],
+    'volatility_threshold': [0.0005, 0.00075, 0.001, 0.0015, 0.002],
+    'leverage': [100],
+    'risk': [0.005, 0.01, 0.02],
+}
+
+# Shared price block attached by each worker process
+_shared_block = None
+_shared_prices = None
+
+
+# Function to list every combination of a parameter grid
+def grid_combinations(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+# Function to draw random combinations from a parameter grid
+def random_combinations(grid, samples, seed=None):
+    combinations = grid_combinations(grid)
+    return random.Random(seed).sample(combinations, min(samples, len(combinations)))
+
+
+# Function to copy the price columns into one shared memory block so they are not pickled per task
+def share_prices(data):
+    shape = (len(PRICE_COLUMNS), len(data))
+    block = shared_memory.SharedMemory(create=True, size=max(shape[0] * shape[1] * 8, 1))
+    prices = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+    for row, column in enumerate(PRICE_COLUMNS):
+        prices[row] = data[column].to_numpy(dtype=np.float64)
+    return block, shape
+
+
+# Function to attach a worker process to the shared price block
+def attach_prices(name, shape):
+    global _shared_block, _shared_prices
+    _shared_block = shared_memory.SharedMemory(name=name)
+    _shared_prices = np.ndarray(shape, dtype=np.float64, buffer=_shared_block.buf)
+
+
+# Function to get the open, high, low, close and spread arrays in a worker process
+def shared_price_arrays():
+    return tuple(_shared_prices)
+
+
+# Function to evaluate the combinations sharing one indicator and signal setting
+def _evaluate_group(short_window, atr_period, volatility_threshold, combinations, initial_capital):
+    open_prices, high, low, close, spread = shared_price_arrays()
+    ma, tr, atr = calculate_indicator_arrays(high, low, close, short_window, atr_period)
+    signal = generate_signal_array(ma, close, atr, volatility_threshold)
+
+    start = WARMUP_BARS
+    results = []
+    for params in combinations:
+        balance, profitable, stop_loss_hit, capital, profitable_signals, total_signals = simulate_trading_kernel(
+            open_prices[start:], spread[start:], signal[start:], ma[start:], low[start:], high[start:],
+            float(initial_capital), float(params['leverage']), float(params['risk']))
+        results.append(dict(params,
+                            final_capital=capital,
+                            total_signals=total_signals,
+                            profitable_signals=profitable_signals,
+                            hit_rate=profitable_signals / total_signals if total_signals else 0.0,
+                            max_drawdown=max_drawdown(balance)))
+    return results
+
+
+# Function to rank sweep results by final capital
+def rank_results(results):
+    ranked = pd.DataFrame(results).sort_values('final_capital', ascending=False, kind='stable')
+    ranked.insert(0, 'rank', np.arange(1, len(ranked) + 1))
+    return ranked.reset_index(drop=True)
+
+
+# Function to run every combination across a process pool and return the ranked results
+def run_sweep(data, combinations, initial_capital=10000, max_workers=None):
+    groups = {}
+    for params in combinations:
+        key = (params['short_window'], params['atr_period'], params['volatility_threshold'])
+        groups.setdefault(key, []).append(params)
+
+    block, shape = share_prices(data)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach_prices,
+                                 initargs=(block.name, shape)) as executor:
+            futures = [executor.submit(_evaluate_group, *key, group, initial_capital)
+                       for key, group in groups.items()]
+            results = [row for future in futures for row in future.result()]
+    finally:
+        block.close()
+        block.unlink()
+
+    return rank_results(results)
+
+
+# Function to load bars exported from copy_rates_from_pos
+def load_bars_csv(path):
+    data = pd.read_csv(path)
+    if 'time' in data.columns:
+        data['time'] = pd.to_datetime(data['time'], unit='s') if data['time'].dtype.kind in 'iuf' \
+            else pd.to_datetime(data['time'])
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parameter sweep for the MA extrema backtester')
+    parser.add_argument('bars', help='CSV of bars with open, high, low, close and spread columns')
+    parser.add_argument('--mode', choices=['grid', 'random'], default='grid')
+    parser.add_argument('--samples', type=int, default=500, help='Combinations to draw in random mode')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--initial-capital', type=float, default=10000)
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    bars = load_bars_csv(args.bars)
+    if args.mode == 'grid':
+        combinations = grid_combinations(DEFAULT_GRID)
+    else:
+        combinations = random_combinations(DEFAULT_GRID, args.samples, args.seed)
+
+    ranked = run_sweep(bars, combinations, args.initial_capital, args.workers)
+    ranked.to_csv(args.output, index=False)
+    print(ranked.head(20).to_string(index=False))
+    print(f"{len(ranked)} combinations written to {args.output}")
@@ -0,0 +1,34 @@
+import numpy as np
+
+from monte_carlo import run_monte_carlo
+
+
+def _trades(count=300, seed=7):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0.0003, 0.01, count), rng.uniform(0.0005, 0.003, count)
+
+
+def test_spread_jitter_is_unbiased():
+    returns, spread_costs = _trades()
+    results = run_monte_carlo(returns, spread_costs, paths=20_000, modes=('spread',), seed=1, max_workers=1)
+
+    # Trades are compounded independently, so the mean final equity matches the backtest's
+    backtest = 10000 * np.prod(1 + returns)
+    final = results['final_equity']
+    assert abs(final.mean() - backtest) < 4 * final.std() / np.sqrt(len(final))
+
+
+def test_reshuffled_paths_end_at_the_backtest_equity():
+    returns, spread_costs = _trades()
+    results = run_monte_carlo(returns, spread_costs, paths=100, modes=('reshuffle',), seed=1, max_workers=1)
+
+    np.testing.assert_allclose(results['final_equity'], 10000 * np.prod(1 + returns), rtol=1e-9)
+    assert (results['max_drawdown'] >= 0).all() and (results['max_drawdown'] < 1).all()
+
+
+def test_results_are_reproducible_from_the_seed():
+    returns, spread_costs = _trades()
+    first = run_monte_carlo(returns, spread_costs, paths=1000, seed=3, max_workers=1)
+    second = run_monte_carlo(returns, spread_costs, paths=1000, seed=3, max_workers=1)
+
+    assert first.equals(second)
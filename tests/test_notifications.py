@@ -0,0 +1,106 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from notifications import NotificationDispatcher
+
+
+# Local stand-in for the Pushover endpoint, answering with the queued status codes (then 200) and recording
+# each request's form fields and arrival time
+class StubEndpoint:
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+        self.received = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                endpoint.requests.append((time.monotonic(), {key: value[0] for key, value in parse_qs(body).items()}))
+                endpoint.received.set()
+                endpoint.release.wait(10)
+                status = endpoint.statuses.pop(0) if endpoint.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/1/messages.json"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def messages(self):
+        return [(fields['title'], fields['message']) for sent, fields in self.requests]
+
+    def close(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def endpoint():
+    stub = StubEndpoint()
+    yield stub
+    stub.close()
+
+
+def test_notifications_with_the_same_title_are_coalesced_within_the_batch_window(endpoint):
+    notifier = NotificationDispatcher('user', 'token', url=endpoint.url, batch_window=0.5)
+    notifier.send('Trade', 'Opened long')
+    notifier.send('Error', 'Order rejected')
+    notifier.send('Trade', 'Closed long')
+    notifier.close()
+
+    assert endpoint.messages() == [('Trade', 'Opened long\nClosed long'), ('Error', 'Order rejected')]
+    assert endpoint.requests[0][1]['token'] == 'token' and endpoint.requests[0][1]['user'] == 'user'
+    assert notifier.failed == 0
+
+
+def test_server_errors_are_retried_with_backoff_then_sent(endpoint):
+    endpoint.statuses = [503, 500]
+    notifier = NotificationDispatcher('user', 'token', url=endpoint.url, batch_window=0.0, max_retries=3,
+                                      backoff=0.1)
+    notifier.send('Trade', 'Opened long')
+    notifier.close()
+
+    times = [sent for sent, fields in endpoint.requests]
+    assert endpoint.messages() == [('Trade', 'Opened long')] * 3
+    assert times[1] - times[0] >= 0.1 and times[2] - times[1] >= 0.2
+    assert notifier.failed == 0
+
+
+def test_retries_are_bounded_and_the_failure_counted(endpoint):
+    endpoint.statuses = [500] * 10
+    notifier = NotificationDispatcher('user', 'token', url=endpoint.url, batch_window=0.0, max_retries=2,
+                                      backoff=0.01)
+    notifier.send('Trade', 'Opened long')
+    notifier.close()
+
+    assert len(endpoint.requests) == 3
+    assert notifier.failed == 1
+
+
+def test_notifications_are_dropped_and_counted_when_the_queue_is_full(endpoint):
+    endpoint.release.clear()
+    notifier = NotificationDispatcher('user', 'token', url=endpoint.url, max_queue=2, batch_window=0.0)
+
+    # Hold the worker in its first request so nothing more is taken off the queue
+    notifier.send('Trade', 'first')
+    assert endpoint.received.wait(5)
+    for number in range(5):
+        notifier.send('Trade', f"queued {number}")
+    assert notifier.dropped == 3
+
+    endpoint.release.set()
+    notifier.close()
+    assert endpoint.messages() == [('Trade', 'first'), ('Trade', 'queued 0\nqueued 1')]
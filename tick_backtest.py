@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import (WARMUP_BARS, calculate_indicator_arrays, generate_signal_array, njit,
+                             simulate_trading_kernel)
+from bar_scheduler import timeframe_seconds
+from bar_store import BAR_DTYPE
+
+# Record layout returned by copy_ticks_range, stored as-is so tick files can be memory-mapped
+TICK_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+    ('last', '<f8'),
+    ('volume', '<u8'),
+    ('time_msc', '<i8'),
+    ('flags', '<u4'),
+    ('volume_real', '<f8'),
+])
+
+# Ticks processed per chunk, bounding memory to a few hundred MB regardless of file size
+CHUNK_TICKS = 4_000_000
+
+
+# Function to append ticks from copy_ticks_range (or any array with the same fields) to a tick file
+def write_ticks(path, ticks):
+    records = np.empty(len(ticks), dtype=TICK_DTYPE)
+    for name in TICK_DTYPE.names:
+        records[name] = ticks[name]
+    with open(path, 'ab') as file:
+        file.write(records.tobytes())
+    return len(records)
+
+
+# Function to convert a CSV tick export to a tick file without loading it all at once
+def csv_to_ticks(csv_path, path, chunksize=1_000_000):
+    total = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        for name in TICK_DTYPE.names:
+            if name not in chunk.columns:
+                chunk[name] = 0
+        if chunk['time_msc'].eq(0).all():
+            chunk['time_msc'] = chunk['time'] * 1000
+        total += write_ticks(path, chunk.to_records(index=False))
+    return total
+
+
+# Function to memory-map a tick file
+def load_ticks(path):
+    count = os.path.getsize(path) // TICK_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=TICK_DTYPE)
+    return np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(count,))
+
+
+# Function to yield ticks in chunks, reading a tick file piece by piece so only one chunk is resident
+def iter_tick_chunks(ticks, chunk_size=CHUNK_TICKS):
+    if isinstance(ticks, str):
+        count = os.path.getsize(ticks) // TICK_DTYPE.itemsize
+        for start in range(0, count, chunk_size):
+            yield np.fromfile(ticks, dtype=TICK_DTYPE, count=min(chunk_size, count - start),
+                              offset=start * TICK_DTYPE.itemsize)
+    else:
+        for start in range(0, len(ticks), chunk_size):
+            yield ticks[start:start + chunk_size]
+
+
+def _tick_count(ticks):
+    return os.path.getsize(ticks) // TICK_DTYPE.itemsize if isinstance(ticks, str) else len(ticks)
+
+
+# Function to build bid-price bars from ticks (an array or tick file path) chunk by chunk, carrying the unfinished bar between chunks
+def build_bars(ticks, timeframe, point=0.01, chunk_size=CHUNK_TICKS):
+    period = timeframe_seconds(timeframe)
+    pieces = []
+    carry = None
+
+    for chunk in iter_tick_chunks(ticks, chunk_size):
+        seconds = chunk['time_msc'] // 1000
+        bar_time = seconds - seconds % period
+        bid = np.asarray(chunk['bid'], dtype=np.float64)
+        ask = np.asarray(chunk['ask'], dtype=np.float64)
+
+        starts = np.flatnonzero(np.r_[True, bar_time[1:] != bar_time[:-1]])
+        bars = np.empty(len(starts), dtype=BAR_DTYPE)
+        bars['time'] = bar_time[starts]
+        bars['open'] = bid[starts]
+        bars['high'] = np.maximum.reduceat(bid, starts)
+        bars['low'] = np.minimum.reduceat(bid, starts)
+        bars['close'] = bid[np.r_[starts[1:], len(bid)] - 1]
+        bars['tick_volume'] = np.diff(np.r_[starts, len(bid)])
+        bars['spread'] = np.rint((ask[starts] - bid[starts]) / point)
+        bars['real_volume'] = 0
+
+        # Merge the first bar of this chunk into the bar carried over from the last one
+        if carry is not None:
+            if bars['time'][0] == carry['time']:
+                first = bars[0]
+                carry['high'] = max(carry['high'], first['high'])
+                carry['low'] = min(carry['low'], first['low'])
+                carry['close'] = first['close']
+                carry['tick_volume'] += first['tick_volume']
+                bars = bars[1:]
+            if len(bars) == 0:
+                continue
+            pieces.append(np.array([carry], dtype=BAR_DTYPE))
+        pieces.append(bars[:-1])
+        carry = bars[-1].copy()
+
+    if carry is not None:
+        pieces.append(np.array([carry], dtype=BAR_DTYPE))
+    return np.concatenate(pieces) if pieces else np.empty(0, dtype=BAR_DTYPE)
+
+
+# Function to run the simulation tick by tick, filling entries and stops at the tick bid/ask
+@njit(cache=True)
+def tick_trading_kernel(bid, ask, bar_index, signal, ma, first_bar, initial_capital, leverage, risk, state,
+                        counters, balance, profitable, stop_loss_hit):
+    # state and counters carry the simulation across chunks
+    capital = state[0]
+    position = state[1]
+    stop_loss = state[2]
+    open_price = state[3]
+    has_stop = counters[0] != 0
+    open_index = counters[1]
+    current_bar = counters[2]
+    profitable_signals = counters[3]
+    total_signals = counters[4]
+    if current_bar < 0:
+        capital = initial_capital
+
+    for j in range(len(bid)):
+        b = bar_index[j]
+        if b < first_bar:
+            continue
+
+        # The first tick of a bar plays the role of the bar open
+        if b != current_bar:
+            current_bar = b
+            buy_price = ask[j]
+            sell_price = bid[j]
+
+            if position > 0:
+                profit_loss = position * (sell_price - open_price)
+            elif position < 0:
+                profit_loss = position * (buy_price - open_price)
+            else:
+                profit_loss = 0.0
+
+            balance[b] = capital + profit_loss
+
+            if signal[b] == 1:
+                if position < 0:
+                    capital += profit_loss
+                    position = 0.0
+                    if profit_loss > 0:
+                        profitable_signals += 1
+                        profitable[open_index] = 1
+                    else:
+                        profitable[open_index] = 0
+                if position == 0:
+                    open_price = buy_price
+                    position = (risk * capital * leverage) / open_price
+                    open_index = b
+                total_signals += 1
+
+            elif signal[b] == -1:
+                if position > 0:
+                    capital += profit_loss
+                    position = 0.0
+                    if profit_loss > 0:
+                        profitable_signals += 1
+                        profitable[open_index] = 1
+                    else:
+                        profitable[open_index] = 0
+                if position == 0:
+                    open_price = sell_price
+                    position = -(risk * capital * leverage) / open_price
+                    open_index = b
+                total_signals += 1
+
+            if profit_loss > 0 and b - first_bar > 1:
+                new_stop_loss = ma[b - 2]
+                if position > 0:
+                    if not has_stop or new_stop_loss > stop_loss:
+                        stop_loss = new_stop_loss
+                        has_stop = True
+                elif position < 0:
+                    if not has_stop or new_stop_loss < stop_loss:
+                        stop_loss = new_stop_loss
+                        has_stop = True
+
+        # Broker-side stop: a long closes at the bid, a short at the ask
+        if has_stop and position != 0:
+            if position > 0 and bid[j] < stop_loss:
+                fill = bid[j]
+            elif position < 0 and ask[j] > stop_loss:
+                fill = ask[j]
+            else:
+                continue
+            profit_loss = position * (fill - open_price)
+            capital += profit_loss
+            stop_loss_hit[b] = fill
+            position = 0.0
+            has_stop = False
+            if profit_loss > 0:
+                profitable_signals += 1
+                profitable[open_index] = 1
+            else:
+                profitable[open_index] = 0
+
+    state[0] = capital
+    state[1] = position
+    state[2] = stop_loss
+    state[3] = open_price
+    counters[0] = 1 if has_stop else 0
+    counters[1] = open_index
+    counters[2] = current_bar
+    counters[3] = profitable_signals
+    counters[4] = total_signals
+
+
+# Function to summarise one simulation result
+def _summary(capital, profitable_signals, total_signals, stop_loss_hit):
+    return {
+        'final_capital': float(capital),
+        'total_signals': int(total_signals),
+        'profitable_signals': int(profitable_signals),
+        'stop_outs': int(np.count_nonzero(~np.isnan(stop_loss_hit))),
+    }
+
+
+# Function to replay ticks (an array or tick file path) through the strategy and report how far it diverges from the bar-level backtest
+def run_tick_backtest(ticks, timeframe, point=0.01, short_window=10, atr_period=14, volatility_threshold=0.001,
+                      initial_capital=10000, leverage=100, risk=0.01, chunk_size=CHUNK_TICKS):
+    bars = build_bars(ticks, timeframe, point, chunk_size)
+    high = bars['high'].astype(np.float64)
+    low = bars['low'].astype(np.float64)
+    close = bars['close'].astype(np.float64)
+    ma, tr, atr = calculate_indicator_arrays(high, low, close, short_window, atr_period)
+    signal = generate_signal_array(ma, close, atr, volatility_threshold)
+
+    # Bar-level result on the same bars
+    start = WARMUP_BARS
+    bar_balance, bar_profitable, bar_stop_loss_hit, bar_capital, bar_profitable_signals, bar_total_signals = \
+        simulate_trading_kernel(bars['open'][start:].astype(np.float64), bars['spread'][start:].astype(np.float64),
+                                signal[start:], ma[start:], low[start:], high[start:],
+                                float(initial_capital), float(leverage), float(risk))
+
+    # Tick-level result, streamed through the file in chunks
+    n = len(bars)
+    balance = np.full(n, np.nan)
+    profitable = np.full(n, np.nan)
+    stop_loss_hit = np.full(n, np.nan)
+    state = np.zeros(4)
+    counters = np.array([0, -1, -1, 0, 0], dtype=np.int64)
+    period = timeframe_seconds(timeframe)
+    bar_times = bars['time']
+    for chunk in iter_tick_chunks(ticks, chunk_size):
+        seconds = chunk['time_msc'] // 1000
+        bar_index = np.searchsorted(bar_times, seconds - seconds % period)
+        tick_trading_kernel(np.asarray(chunk['bid'], dtype=np.float64), np.asarray(chunk['ask'], dtype=np.float64),
+                            bar_index, signal, ma, start, float(initial_capital), float(leverage), float(risk),
+                            state, counters, balance, profitable, stop_loss_hit)
+
+    capital = state[0] if counters[2] >= 0 else float(initial_capital)
+    tick_profitable = profitable[start:]
+    tick_stop_loss_hit = stop_loss_hit[start:]
+    bar_stopped = ~np.isnan(bar_stop_loss_hit)
+    tick_stopped = ~np.isnan(tick_stop_loss_hit)
+    both_stopped = bar_stopped & tick_stopped
+
+    report = {
+        'ticks': int(_tick_count(ticks)),
+        'bars': int(n),
+        'bar': _summary(bar_capital, bar_profitable_signals, bar_total_signals, bar_stop_loss_hit),
+        'tick': _summary(capital, counters[3], counters[4], tick_stop_loss_hit),
+        'divergence': {
+            'capital_difference': float(capital - bar_capital),
+            'stop_out_mismatches': int(np.count_nonzero(bar_stopped != tick_stopped)),
+            'profitable_mismatches': int(np.count_nonzero(
+                (np.isnan(bar_profitable) != np.isnan(tick_profitable)) |
+                (~np.isnan(bar_profitable) & ~np.isnan(tick_profitable) & (bar_profitable != tick_profitable)))),
+            'mean_stop_slippage': float(np.mean(np.abs(tick_stop_loss_hit[both_stopped] -
+                                                       bar_stop_loss_hit[both_stopped])))
+            if both_stopped.any() else 0.0,
+        },
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tick-level replay of the MA extrema backtest')
+    parser.add_argument('ticks', help='Tick file written by write_ticks, or a CSV export of copy_ticks_range')
+    parser.add_argument('--timeframe', type=int, default=5, help='MT5 timeframe constant, 5 for M5')
+    parser.add_argument('--point', type=float, default=0.01)
+    parser.add_argument('--chunk-ticks', type=int, default=CHUNK_TICKS)
+    parser.add_argument('--output', default=None, help='Write the report as JSON')
+    args = parser.parse_args()
+
+    tick_path = args.ticks
+    if tick_path.endswith('.csv'):
+        tick_path = os.path.splitext(tick_path)[0] + '.ticks'
+        if not os.path.exists(tick_path):
+            csv_to_ticks(args.ticks, tick_path)
+
+    result = run_tick_backtest(tick_path, args.timeframe, args.point, chunk_size=args.chunk_ticks)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
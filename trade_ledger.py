@@ -0,0 +1,129 @@
+import numpy as np
+
+EXIT_REASONS = ('signal', 'stop_loss', 'open')
+EXIT_SIGNAL, EXIT_STOP_LOSS, EXIT_OPEN = range(len(EXIT_REASONS))
+
+# One row per trade, shared by the backtest and the live bot. Times are epoch seconds, size is in units of the
+# instrument (lots times contract size) and pnl is in account currency
+TRADE_DTYPE = np.dtype([
+    ('position_id', '<i8'),
+    ('symbol', '<U16'),
+    ('direction', 'i1'),  # 1 for long, -1 for short
+    ('entry_time', '<i8'),
+    ('exit_time', '<i8'),
+    ('entry_price', '<f8'),
+    ('exit_price', '<f8'),
+    ('size', '<f8'),
+    ('pnl', '<f8'),
+    ('exit_reason', 'i1'),  # Index into EXIT_REASONS
+])
+
+
+# Append-only trade records kept in a preallocated structured array
+class TradeLedger:
+    def __init__(self, capacity=1024):
+        self.records = np.zeros(capacity, dtype=TRADE_DTYPE)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, extra):
+        needed = self.count + extra
+        if needed > len(self.records):
+            grown = np.zeros(max(needed, 2 * len(self.records)), dtype=TRADE_DTYPE)
+            grown[:self.count] = self.records[:self.count]
+            self.records = grown
+
+    # Record one closed trade
+    def append(self, position_id, symbol, direction, entry_time, exit_time, entry_price, exit_price, size, pnl,
+               exit_reason):
+        self._reserve(1)
+        self.records[self.count] = (position_id, symbol, direction, entry_time, exit_time, entry_price, exit_price,
+                                    size, pnl, exit_reason)
+        self.count += 1
+
+    # Record a block of trades given as a structured array or a mapping of column arrays
+    def extend(self, columns, length):
+        self._reserve(length)
+        block = self.records[self.count:self.count + length]
+        for name in TRADE_DTYPE.names:
+            if name in columns:
+                block[name] = columns[name]
+        self.count += length
+
+    def view(self):
+        return self.records[:self.count]
+
+    # Function to convert the records to a DataFrame with readable times, directions and exit reasons
+    def frame(self):
+        # Imported here so the live bot starts without pandas, which is only needed to save the ledger
+        import pandas as pd
+
+        records = self.view()
+        return pd.DataFrame({
+            'position_id': records['position_id'],
+            'symbol': records['symbol'],
+            'direction': np.where(records['direction'] > 0, 'long', 'short'),
+            'entry_time': pd.to_datetime(records['entry_time'], unit='s'),
+            'exit_time': pd.to_datetime(records['exit_time'], unit='s'),
+            'entry_price': records['entry_price'],
+            'exit_price': records['exit_price'],
+            'size': records['size'],
+            'pnl': records['pnl'],
+            'exit_reason': np.array(EXIT_REASONS)[records['exit_reason']],
+        })
+
+    def to_parquet(self, path):
+        self.frame().to_parquet(path, index=False)
+
+    def to_csv(self, path):
+        self.frame().to_csv(path, index=False)
+
+    @classmethod
+    def from_parquet(cls, path):
+        import pandas as pd
+
+        data = pd.read_parquet(path)
+        ledger = cls(max(len(data), 1))
+        ledger.extend({
+            'position_id': data['position_id'].to_numpy(),
+            'symbol': data['symbol'].to_numpy(dtype=str),
+            'direction': np.where(data['direction'] == 'long', 1, -1),
+            'entry_time': data['entry_time'].to_numpy().astype('datetime64[s]').astype(np.int64),
+            'exit_time': data['exit_time'].to_numpy().astype('datetime64[s]').astype(np.int64),
+            'entry_price': data['entry_price'].to_numpy(),
+            'exit_price': data['exit_price'].to_numpy(),
+            'size': data['size'].to_numpy(),
+            'pnl': data['pnl'].to_numpy(),
+            'exit_reason': pd.Index(EXIT_REASONS).get_indexer(data['exit_reason']),
+        }, len(data))
+        return ledger
+
+
+# Function to build the ledger of a backtested DataFrame (time index, Signal, StopLoss and Balance columns),
+# also returning the number of bars a position was held
+def backtest_ledger(data, symbol='', leverage=100, risk=0.01):
+    # Imported here so the live bot does not load the backtest engine (and numba) with the ledger
+    from backtest_engine import extract_trades
+
+    columns = (data[column].to_numpy(dtype=np.float64)
+               for column in ('open', 'spread', 'Signal', 'StopLoss', 'Balance'))
+    position_id, entry_index, exit_index, direction, entry_price, exit_price, size, pnl, exit_reason, \
+        bars_in_market = extract_trades(*columns, float(leverage), float(risk))
+    times = data.index.to_numpy().astype('datetime64[s]').astype(np.int64)
+
+    ledger = TradeLedger(max(len(pnl), 1))
+    ledger.extend({
+        'position_id': position_id,
+        'symbol': symbol,
+        'direction': direction,
+        'entry_time': times[entry_index],
+        'exit_time': times[exit_index],
+        'entry_price': entry_price,
+        'exit_price': exit_price,
+        'size': size,
+        'pnl': pnl,
+        'exit_reason': exit_reason,
+    }, len(pnl))
+    return ledger, bars_in_market
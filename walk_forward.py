@@ -0,0 +1,149 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import (WARMUP_BARS, calculate_indicator_arrays, generate_signal_array, max_drawdown,
+                             simulate_trading_kernel)
+from sweep import DEFAULT_GRID, attach_prices, grid_combinations, load_bars_csv, share_prices, shared_price_arrays
+
+# Indicator and signal arrays kept per worker, keyed by (short_window, atr_period, volatility_threshold)
+_signal_cache = {}
+SIGNAL_CACHE_SIZE = 8
+
+
+# Function to split a bar history into (train_start, train_end, test_start, test_end) windows
+def walk_forward_windows(n, train_bars, test_bars, step=None, anchored=False, start=WARMUP_BARS):
+    step = test_bars if step is None else step
+    windows = []
+    train_start = start
+    while True:
+        train_end = train_start + train_bars
+        test_end = train_end + test_bars
+        if test_end > n:
+            break
+        windows.append((start if anchored else train_start, train_end, train_end, test_end))
+        train_start += step
+    return windows
+
+
+# Function to compute (or reuse) the MA and signal arrays over the full history for one setting
+def _signal_arrays(short_window, atr_period, volatility_threshold):
+    key = (short_window, atr_period, volatility_threshold)
+    if key not in _signal_cache:
+        if len(_signal_cache) >= SIGNAL_CACHE_SIZE:
+            _signal_cache.pop(next(iter(_signal_cache)))
+        open_prices, high, low, close, spread = shared_price_arrays()
+        ma, tr, atr = calculate_indicator_arrays(high, low, close, short_window, atr_period)
+        _signal_cache[key] = (ma, generate_signal_array(ma, close, atr, volatility_threshold))
+    return _signal_cache[key]
+
+
+def _simulate_slice(ma, signal, start, end, initial_capital, leverage, risk):
+    open_prices, high, low, close, spread = shared_price_arrays()
+    return simulate_trading_kernel(open_prices[start:end], spread[start:end], signal[start:end], ma[start:end],
+                                   low[start:end], high[start:end], float(initial_capital), float(leverage),
+                                   float(risk))
+
+
+# Function to score every window's train slice for the combinations sharing one indicator setting
+def _train_group(short_window, atr_period, volatility_threshold, combinations, windows, initial_capital):
+    # The arrays are computed once over the whole history and sliced for every overlapping window
+    ma, signal = _signal_arrays(short_window, atr_period, volatility_threshold)
+    results = []
+    for window, (train_start, train_end, test_start, test_end) in enumerate(windows):
+        for params in combinations:
+            balance, profitable, stop_loss_hit, capital, profitable_signals, total_signals = _simulate_slice(
+                ma, signal, train_start, train_end, initial_capital, params['leverage'], params['risk'])
+            results.append(dict(params, window=window, train_capital=capital))
+    return results
+
+
+# Function to run the chosen parameters over one window's test slice
+def _test_window(window, params, test_start, test_end, initial_capital):
+    ma, signal = _signal_arrays(params['short_window'], params['atr_period'], params['volatility_threshold'])
+    balance, profitable, stop_loss_hit, capital, profitable_signals, total_signals = _simulate_slice(
+        ma, signal, test_start, test_end, initial_capital, params['leverage'], params['risk'])
+    return {
+        'window': window,
+        'test_equity': float(balance[-1]) if len(balance) else float(initial_capital),
+        'test_signals': total_signals,
+        'test_hit_rate': profitable_signals / total_signals if total_signals else 0.0,
+        'test_max_drawdown': max_drawdown(balance),
+        'balance': balance,
+    }
+
+
+# Function to optimise on each train slice, evaluate on the following test slice and stitch the test equity
+def run_walk_forward(data, windows, combinations, initial_capital=10000, max_workers=None):
+    groups = {}
+    for params in combinations:
+        key = (params['short_window'], params['atr_period'], params['volatility_threshold'])
+        groups.setdefault(key, []).append(params)
+
+    block, shape = share_prices(data)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach_prices,
+                                 initargs=(block.name, shape)) as executor:
+            futures = [executor.submit(_train_group, *key, group, windows, initial_capital)
+                       for key, group in groups.items()]
+            train_results = pd.DataFrame([row for future in futures for row in future.result()])
+
+            # Best train result per window, ties going to the first combination listed
+            best = train_results.sort_values('train_capital', ascending=False, kind='stable') \
+                .drop_duplicates('window').set_index('window').sort_index()
+
+            futures = []
+            for window, (train_start, train_end, test_start, test_end) in enumerate(windows):
+                params = {name: best.at[window, name] for name in combinations[0]}
+                futures.append(executor.submit(_test_window, window, params, test_start, test_end,
+                                               initial_capital))
+            test_results = [future.result() for future in futures]
+    finally:
+        block.close()
+        block.unlink()
+
+    # Sizing is proportional to capital, so each test curve is rescaled to start from the previous window's end
+    times = data['time'].to_numpy() if 'time' in data.columns else data.index.to_numpy()
+    curves = []
+    equity = float(initial_capital)
+    for (train_start, train_end, test_start, test_end), result in zip(windows, test_results):
+        scale = equity / initial_capital
+        curves.append(pd.Series(result['balance'] * scale, index=times[test_start:test_end]))
+        equity = result['test_equity'] * scale
+    equity_curve = pd.concat(curves) if curves else pd.Series(dtype=np.float64)
+
+    summary = best.reset_index()
+    summary.insert(1, 'train_start', [times[window[0]] for window in windows])
+    summary.insert(2, 'test_start', [times[window[2]] for window in windows])
+    summary.insert(3, 'test_end', [times[window[3] - 1] for window in windows])
+    for column in ('test_equity', 'test_signals', 'test_hit_rate', 'test_max_drawdown'):
+        summary[column] = [result[column] for result in test_results]
+    summary['test_return'] = summary['test_equity'] / initial_capital - 1
+
+    return summary, equity_curve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Walk-forward evaluation of the MA extrema backtester')
+    parser.add_argument('bars', help='CSV of bars with time, open, high, low, close and spread columns')
+    parser.add_argument('--train-bars', type=int, default=20000)
+    parser.add_argument('--test-bars', type=int, default=5000)
+    parser.add_argument('--step', type=int, default=None, help='Bars between windows, defaults to --test-bars')
+    parser.add_argument('--anchored', action='store_true', help='Grow the train slice from the start')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--initial-capital', type=float, default=10000)
+    parser.add_argument('--output', default='walk_forward')
+    args = parser.parse_args()
+
+    bars = load_bars_csv(args.bars)
+    windows = walk_forward_windows(len(bars), args.train_bars, args.test_bars, args.step, args.anchored)
+    summary, equity_curve = run_walk_forward(bars, windows, grid_combinations(DEFAULT_GRID), args.initial_capital,
+                                             args.workers)
+
+    summary.to_csv(f"{args.output}_windows.csv", index=False)
+    equity_curve.rename('equity').to_csv(f"{args.output}_equity.csv", index_label='time')
+    print(summary.to_string(index=False))
+    if len(equity_curve):
+        print(f"Out-of-sample final equity: {equity_curve.iloc[-1]:.2f} over {len(windows)} windows")